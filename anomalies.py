@@ -0,0 +1,252 @@
+import argparse
+import calendar
+import math
+import sqlite3
+import statistics
+from array import array
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import db
+from db import DB_PATH
+
+# Streaming anomaly detection for every series in the store. Each series keeps a small
+# state row: its last point, an EWMA mean/variance of period-over-period changes and the
+# last WINDOW changes (packed doubles) for a rolling median/MAD. A new point is scored
+# against that state and folded into it in constant time, so ingesting a point never
+# rescans history. The state before the last point is kept too, so a revision of the
+# latest point (the usual kind) is re-scored in constant time as well. Changes rather than
+# levels are scored, since the series trend and construction output crosses zero. A point
+# is an anomaly when both the EWMA z-score and the robust (median/MAD) z-score reach
+# THRESHOLD. Quarterly and yearly points averaged from a finer series of the same
+# indicator are only scored once their period is closed.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomaly_state (
+    series_id INTEGER PRIMARY KEY REFERENCES series (series_id),
+    last_datetime TEXT NOT NULL,
+    last_value REAL NOT NULL,
+    count INTEGER NOT NULL,
+    ewma_mean REAL NOT NULL,
+    ewma_var REAL NOT NULL,
+    window BLOB NOT NULL,
+    prev_datetime TEXT,
+    prev_value REAL,
+    prev_count INTEGER,
+    prev_ewma_mean REAL,
+    prev_ewma_var REAL,
+    prev_window BLOB
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS anomalies (
+    series_id INTEGER NOT NULL REFERENCES series (series_id),
+    datetime TEXT NOT NULL,
+    value REAL NOT NULL,
+    previous_value REAL NOT NULL,
+    change REAL NOT NULL,
+    expected_change REAL NOT NULL,
+    ewma_z REAL NOT NULL,
+    robust_z REAL NOT NULL,
+    score REAL NOT NULL,
+    detected_at TEXT NOT NULL,
+    PRIMARY KEY (series_id, datetime)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_anomalies_datetime ON anomalies (datetime, score);
+"""
+
+ALPHA = 0.2  # EWMA weight of the newest change
+WINDOW = 24  # changes kept for the rolling median/MAD
+WARMUP = 6  # changes seen before a point is scored
+THRESHOLD = 3.0
+MAD_SCALE = 1.4826  # MAD of a normal distribution -> standard deviation
+PREVIOUS_COLUMNS = {"prev_datetime": "TEXT", "prev_value": "REAL", "prev_count": "INTEGER",
+                    "prev_ewma_mean": "REAL", "prev_ewma_var": "REAL", "prev_window": "BLOB"}
+# Series at these frequencies are averages of the finer ones of the same indicator
+SOURCE_FREQUENCIES = {"Q": ["M"], "Y": ["M", "Q"]}
+
+
+def ensure_schema(conn):
+    for statement in SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    # State rows written before the previous state was kept; those series replay once
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(anomaly_state)")}
+    for name, column_type in PREVIOUS_COLUMNS.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE anomaly_state ADD COLUMN {name} {column_type}")
+
+
+def _state(last_datetime, last_value, count, mean, var, window):
+    return {"last_datetime": last_datetime, "last_value": last_value, "count": count,
+            "mean": mean, "var": var, "window": list(array("d", window)), "previous": None}
+
+
+def _load_state(conn, series_id):
+    row = conn.execute(f"SELECT last_datetime, last_value, count, ewma_mean, ewma_var, window, "
+                       f"{', '.join(PREVIOUS_COLUMNS)} FROM anomaly_state WHERE series_id = ?", (series_id,)).fetchone()
+    if row is None:
+        return None
+    state = _state(*row[:6])
+    if row[6] is not None:
+        state["previous"] = _state(*row[6:])
+    return state
+
+
+def _fields(state):
+    if state is None:
+        return (None,) * 6
+    return (state["last_datetime"], state["last_value"], state["count"], state["mean"], state["var"],
+            array("d", state["window"]).tobytes())
+
+
+def _save_state(conn, series_id, state):
+    conn.execute(f"INSERT OR REPLACE INTO anomaly_state VALUES ({','.join('?' * 13)})",
+                 (series_id, *_fields(state), *_fields(state["previous"])))
+
+
+def closed_through(conn, series_id):
+    # Last datetime of the series whose period is closed: a quarter or year averaged from a
+    # finer series of the same indicator is partial until that series reaches its last month
+    # (or quarter). None when every point is final.
+    country, indicator, frequency = conn.execute(
+        "SELECT country, indicator, frequency FROM series WHERE series_id = ?", (series_id,)).fetchone()
+    for source in SOURCE_FREQUENCIES.get(frequency, []):
+        latest = conn.execute("""
+            SELECT MAX(v.datetime) FROM series s JOIN series_values v ON v.series_id = s.series_id
+            WHERE s.country = ? AND s.indicator = ? AND s.frequency = ?
+        """, (country, indicator, source)).fetchone()[0]
+        if latest is None:
+            continue
+        d = datetime.fromisoformat(latest)
+        covered = d.month if source == "M" else (d.month - 1) // 3 * 3 + 3
+        last_month = (d.month - 1) // 3 * 3 + 3 if frequency == "Q" else 12
+        year, month = d.year, last_month
+        if covered != last_month:
+            # The period containing `latest` is still open; the one before it is the last closed
+            month -= 3 if frequency == "Q" else 12
+            if month <= 0:
+                year, month = year - 1, month + 12
+        return f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d} 00:00:00"
+    return None
+
+
+def score(state, change):
+    # (expected change, EWMA z, robust z) of a change against the state before it
+    if state["count"] < WARMUP:
+        return None
+    median = statistics.median(state["window"])
+    mad = statistics.median(abs(c - median) for c in state["window"]) * MAD_SCALE
+    ewma_z = (change - state["mean"]) / math.sqrt(state["var"]) if state["var"] > 0 else 0.0
+    robust_z = (change - median) / mad if mad > 0 else 0.0
+    return median, ewma_z, robust_z
+
+
+def fold(state, change):
+    delta = change - state["mean"]
+    state["mean"] += ALPHA * delta
+    state["var"] = (1 - ALPHA) * (state["var"] + ALPHA * delta * delta)
+    state["window"].append(change)
+    if len(state["window"]) > WINDOW:
+        del state["window"][0]
+    state["count"] += 1
+
+
+def _process(conn, series_id, state, points, detected_at):
+    anomalies = []
+    for index, (key, value) in enumerate(points):
+        if state is None:
+            state = {"last_datetime": key, "last_value": value, "count": 0, "mean": 0.0, "var": 0.0, "window": [],
+                     "previous": None}
+            continue
+        if index == len(points) - 1:
+            # Kept so that a revision of this point can be re-scored without a replay
+            state["previous"] = dict(state, window=list(state["window"]), previous=None)
+        change = value - state["last_value"]
+        scored = score(state, change)
+        if scored is not None:
+            expected, ewma_z, robust_z = scored
+            if abs(ewma_z) >= THRESHOLD and abs(robust_z) >= THRESHOLD:
+                # Score is the weaker of the two agreeing signals, signed like the deviation
+                strength = math.copysign(min(abs(ewma_z), abs(robust_z)), change - expected)
+                anomalies.append((series_id, key, value, state["last_value"], change, expected,
+                                  round(ewma_z, 3), round(robust_z, 3), round(strength, 3), detected_at))
+        if state["count"] == 0:
+            # The first change seeds the mean so the variance does not start from a jump off zero
+            state["mean"] = change
+        fold(state, change)
+        state["last_datetime"], state["last_value"] = key, value
+    if state is not None:
+        _save_state(conn, series_id, state)
+    conn.executemany(f"INSERT OR REPLACE INTO anomalies VALUES ({','.join('?' * 10)})", anomalies)
+    return len(anomalies)
+
+
+def update(conn, series_ids=None, since=None, rebuild=False):
+    # Scores the closed points each series (default: all) gained since its last update.
+    # When points at or before its last processed date changed (`since`), a series rolls
+    # back to the state before its last point if that covers them, or else is replayed.
+    ensure_schema(conn)
+    if series_ids is None:
+        series_ids = [row[0] for row in conn.execute("SELECT series_id FROM series")]
+    detected_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    found = 0
+    for series_id in series_ids:
+        state = None if rebuild else _load_state(conn, series_id)
+        if state is not None and since is not None and since <= state["last_datetime"]:
+            previous = state["previous"]
+            state = previous if previous is not None and since > previous["last_datetime"] else None
+            if state is not None:
+                conn.execute("DELETE FROM anomalies WHERE series_id = ? AND datetime > ?",
+                             (series_id, state["last_datetime"]))
+        if state is None:
+            conn.execute("DELETE FROM anomalies WHERE series_id = ?", (series_id,))
+            conn.execute("DELETE FROM anomaly_state WHERE series_id = ?", (series_id,))
+        until = closed_through(conn, series_id)
+        points = conn.execute("SELECT datetime, value FROM series_values WHERE series_id = ? AND datetime > ? "
+                              "AND datetime <= ? ORDER BY datetime",
+                              (series_id, "" if state is None else state["last_datetime"], until or "9999"))
+        found += _process(conn, series_id, state, points.fetchall(), detected_at)
+    return found
+
+
+def recent(limit=20, country=None, path=DB_PATH):
+    # Latest anomalies across all series, newest first, for the dashboards' alerts panel
+    sql = """
+        SELECT s.country, s.indicator, s.name, s.frequency, a.datetime, a.value, a.previous_value,
+               a.change, a.expected_change, a.score
+        FROM anomalies a JOIN series s ON s.series_id = a.series_id
+    """
+    params = []
+    if country is not None:
+        sql += " WHERE s.country = ?"
+        params.append(country)
+    sql += " ORDER BY a.datetime DESC, ABS(a.score) DESC LIMIT ?"
+    params.append(limit)
+    try:
+        return db.read_sql(sql, params, path=path)
+    except pd.errors.DatabaseError:
+        # anomalies.py has not run against this database yet
+        return pd.DataFrame(columns=["country", "indicator", "name", "frequency", "datetime", "value",
+                                     "previous_value", "change", "expected_change", "score"])
+
+
+def run(path=DB_PATH, rebuild=False):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            return update(conn, rebuild=rebuild)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score new points of every series and record anomalies")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="discard the rolling state and replay all history")
+    args = parser.parse_args()
+
+    found = run(args.db, args.rebuild)
+    print(f"{found} new anomalies recorded")
+
+
+if __name__ == "__main__":
+    main()
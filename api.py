@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pandas as pd
+
+import db
+from db import DB_PATH
+from ingest import DATE_FORMAT
+from kpi import latest_vs_previous, period_change, rolling_mean
+from series_store import DEFAULT_COUNTRY, SeriesStore
+
+# Read-only JSON API over market_data.db for the n8n assistant and other local tools,
+# built on the standard library only. Responses are computed once per data version and
+# kept in memory; the ETag is derived from the data version and the request, so an
+# If-None-Match revalidation is answered with 304 without touching the database.
+#
+#   GET /series                              catalog (?country=, ?frequency=)
+#   GET /series/<indicator>                  values (?country=, ?frequency=)
+#   GET /kpis                                latest vs previous per indicator (?frequency=Q)
+#   GET /qoq, /yoy                           period-over-period % change tables
+#   GET /moving-average                      trailing mean (?indicator=, ?frequency=M, ?window=3)
+#   GET /predictions/latest                  latest building_permit_predictions row
+#
+# Tables take ?start= and ?end= (YYYY-MM-DD) and are paginated with ?limit= and ?offset=.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+MAX_CACHED_RESPONSES = 256
+# Requests answered at startup so the first agent calls are already cached
+WARM_PATHS = ["/series", "/kpis?frequency=Q", "/kpis?frequency=M", "/qoq", "/yoy", "/moving-average",
+              "/predictions/latest"]
+CHANGE_FREQUENCIES = {"qoq": "Q", "yoy": "Y"}
+
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _records(df):
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def _date(query, name):
+    value = query.get(name)
+    if value is None:
+        return None
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be a date (YYYY-MM-DD)")
+
+
+def _int(query, name, default, low, high):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if not low <= value <= high:
+        raise ApiError(400, f"{name} must be between {low} and {high}")
+    return value
+
+
+def _date_range(query):
+    start, end = _date(query, "start"), _date(query, "end")
+    if end is not None:
+        end = end.normalize() + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return start, end
+
+
+def _filter_dates(df, column, query):
+    start, end = _date_range(query)
+    if start is not None:
+        df = df[df[column] >= start]
+    if end is not None:
+        df = df[df[column] <= end]
+    return df
+
+
+def _page(df, route, query):
+    limit = _int(query, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT)
+    offset = _int(query, "offset", 0, 0, 10 ** 9)
+    following = None
+    if offset + limit < len(df):
+        following = f"{route}?{urlencode({**query, 'offset': offset + limit, 'limit': limit})}"
+    return {"data": _records(df.iloc[offset:offset + limit]), "total": len(df), "limit": limit,
+            "offset": offset, "next": following}
+
+
+class Api:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.store = SeriesStore(path)
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def etag(self, route, query):
+        key = repr((db.data_version(self.path), route, sorted(query.items())))
+        return '"' + hashlib.sha1(key.encode()).hexdigest()[:24] + '"'
+
+    def response(self, route, query):
+        # (etag, body) for a request, built at most once per data version
+        etag = self.etag(route, query)
+        with self._lock:
+            if etag in self._responses:
+                self._responses.move_to_end(etag)
+                return etag, self._responses[etag]
+        body = json.dumps(self.handle(route, query), separators=(",", ":")).encode()
+        with self._lock:
+            self._responses[etag] = body
+            while len(self._responses) > MAX_CACHED_RESPONSES:
+                self._responses.popitem(last=False)
+        return etag, body
+
+    def handle(self, route, query):
+        country = query.get("country", DEFAULT_COUNTRY)
+        parts = [part for part in route.split("/") if part]
+        if parts == ["series"]:
+            catalog = self.store.catalog(query.get("country"), query.get("frequency"))
+            return _page(catalog, route, query)
+        if len(parts) == 2 and parts[0] == "series":
+            frequency = query.get("frequency", "Q")
+            if parts[1] not in set(self.store.catalog(country, frequency)["indicator"]):
+                raise ApiError(404, f"no {frequency} series {parts[1]} for {country}")
+            start, end = _date_range(query)
+            df = self.store.load([parts[1]], country, frequency,
+                                 None if start is None else start.strftime(DATE_FORMAT),
+                                 None if end is None else end.strftime(DATE_FORMAT))
+            return _page(df, route, query)
+        if parts == ["kpis"]:
+            frequency = query.get("frequency", "Q")
+            indicators = list(self.store.catalog(country, frequency)["indicator"])
+            kpis = latest_vs_previous(self.store.latest(indicators, country, frequency, n=2), frequency)
+            return {"data": _records(kpis)}
+        if len(parts) == 1 and parts[0] in CHANGE_FREQUENCIES:
+            df = period_change(self.store.load(None, country, CHANGE_FREQUENCIES[parts[0]]))
+            return _page(_filter_dates(df.iloc[1:], "datetime", query), route, query)
+        if parts == ["moving-average"]:
+            indicator = query.get("indicator", "construction_output")
+            frequency = query.get("frequency", "M")
+            window = _int(query, "window", 3, 1, 120)
+            df = self.store.load([indicator], country, frequency)
+            if indicator not in df.columns:
+                raise ApiError(404, f"no {frequency} series {indicator} for {country}")
+            df = pd.DataFrame({"datetime": df["datetime"], "value": df[indicator],
+                               "moving_average": rolling_mean(df, window)[indicator]})
+            return _page(_filter_dates(df, "datetime", query), route, query)
+        if parts == ["predictions", "latest"]:
+            df = db.read_sql("SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1",
+                             path=self.path)
+            return {"data": _records(df)[0] if len(df) else None}
+        raise ApiError(404, f"unknown endpoint {route}")
+
+    def warm(self):
+        for path in WARM_PATHS:
+            parts = urlsplit(path)
+            self.response(parts.path, {k: v[-1] for k, v in parse_qs(parts.query).items()})
+
+
+class Handler(BaseHTTPRequestHandler):
+    api = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        route = parts.path.rstrip("/") or "/"
+        query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+        try:
+            etag = self.api.etag(route, query)
+            if etag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+                self._send(304, b"", etag)
+                return
+            etag, body = self.api.response(route, query)
+            self._send(200, body, etag)
+        except ApiError as error:
+            self._send(error.status, json.dumps({"error": str(error)}).encode())
+        except Exception:
+            logger.exception("GET %s failed", self.path)
+            self._send(500, json.dumps({"error": "internal error"}).encode())
+
+    def _send(self, status, body, etag=None):
+        self.send_response(status)
+        if etag is not None:
+            self.send_header("ETag", etag)
+            # Clients may keep responses but must revalidate; that costs one 304
+            self.send_header("Cache-Control", "no-cache")
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(path=DB_PATH, host=DEFAULT_HOST, port=DEFAULT_PORT, warm=True):
+    api = Api(path)
+    if warm:
+        api.warm()
+    server = ThreadingHTTPServer((host, port), type("ApiHandler", (Handler,), {"api": api}))
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the dashboards' series and KPIs as a read-only JSON API")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    server = serve(args.db, args.host, args.port)
+    print(f"Serving {args.db} on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import forecasts
+from db import DB_PATH
+from series_store import DEFAULT_COUNTRY, SeriesStore
+
+# Expanding-window walk-forward backtests of the notebook's model types: the regressions
+# (LinearRegression, RandomForestRegressor) and Prophet. Unlike the notebook's random
+# train_test_split, every fold trains only on rows whose target was known at the fold's
+# origin and predicts `horizon` periods past it. The regressions are run on the notebook's
+# feature sets and on a lag matrix; the matrix of each (country, frequency) group is built
+# once and sliced by every fold, series, horizon, model and feature set. The tasks run in
+# a process pool.
+LINEAR = forecasts.REGRESSION
+RANDOM_FOREST = "random_forest"
+MODELS = [LINEAR, RANDOM_FOREST, forecasts.PROPHET]
+HORIZONS = {"M": [1, 3, 6], "Q": [1, 2, 4]}
+# Points of history before the first fold origin
+MIN_TRAIN = {"M": 24, "Q": 8}
+# Regression features: this period's residential prices (the notebook's univariate model,
+# which forecasts.py runs), every other indicator this period (the notebook's "all
+# features"), or every indicator at t, t-1, ..., t-(LAGS-1)
+NOTEBOOK = "notebook"
+SAME_PERIOD = "same_period"
+LAGGED = "lags"
+FEATURE_SETS = [NOTEBOOK, SAME_PERIOD, LAGGED]
+NOTEBOOK_FEATURES = ["residential_prices"]
+LAGS = 4
+# Regressions need at least this many complete training rows, and more rows than features
+MIN_FIT_ROWS = 6
+
+
+def feature_matrix(wide, lags=LAGS):
+    # Built once per group; NaN where an indicator or one of its lags is missing
+    values = wide.drop(columns="datetime")
+    return pd.DataFrame({f"{column}_lag{lag}": values[column].shift(lag)
+                         for lag in range(lags) for column in values.columns}, index=wide.index)
+
+
+def feature_columns(feature_set, features, indicator):
+    # Columns of the group's feature matrix that one target's regressions use
+    if feature_set == NOTEBOOK:
+        columns = [f"{column}_lag0" for column in NOTEBOOK_FEATURES]
+    elif feature_set == SAME_PERIOD:
+        columns = [column for column in features.columns if column.endswith("_lag0") and column != f"{indicator}_lag0"]
+    else:
+        columns = list(features.columns)
+    return [column for column in columns if column in features.columns]
+
+
+def _origins(n, frequency, step):
+    return list(range(MIN_TRAIN[frequency] - 1, n - 1, step))
+
+
+def _regressor(model):
+    if model == RANDOM_FOREST:
+        from sklearn.ensemble import RandomForestRegressor
+        # Same settings as the notebook
+        return RandomForestRegressor(n_estimators=100, random_state=42)
+    from sklearn.linear_model import LinearRegression
+    return LinearRegression()
+
+
+def _backtest_regression(task):
+    # Runs in a worker process. Row t has features at t and target y[t + h]; at origin o
+    # the training rows are t <= o - h, whose targets had been observed by then.
+    features, y = task["features"].to_numpy(dtype=float), task["y"].to_numpy(dtype=float)
+    dates = task["datetimes"]
+    complete = ~np.isnan(features).any(axis=1)
+    rows = []
+    for horizon in task["horizons"]:
+        target = np.full(len(y), np.nan)
+        target[:len(y) - horizon] = y[horizon:]
+        for origin in task["origins"]:
+            if origin + horizon >= len(y) or not complete[origin] or np.isnan(target[origin]):
+                continue
+            train = np.flatnonzero(complete[:origin - horizon + 1] & ~np.isnan(target[:origin - horizon + 1]))
+            if len(train) < max(MIN_FIT_ROWS, features.shape[1] + 1):
+                continue
+            start = time.perf_counter()
+            model = _regressor(task["model"])
+            model.fit(features[train], target[train])
+            predicted = float(model.predict(features[[origin]])[0])
+            rows.append((dates[origin], horizon, len(train), target[origin], predicted,
+                         (time.perf_counter() - start) * 1000))
+    return rows
+
+
+def _backtest_prophet(task):
+    # One fit per origin serves every horizon; actuals are matched on the forecast dates
+    history, dates = task["history"], task["datetimes"]
+    observed = dict(zip(history["ds"], history["y"]))
+    rows = []
+    for origin in task["origins"]:
+        train = history[history["ds"] <= dates[origin]].dropna()
+        if len(train) < MIN_FIT_ROWS or dates[origin] not in observed or pd.isna(observed[dates[origin]]):
+            continue
+        start = time.perf_counter()
+        forecast = forecasts._fit_prophet({"history": train, "horizon": max(task["horizons"]), "freq": task["freq"]})
+        fit_ms = (time.perf_counter() - start) * 1000
+        for ds, step, yhat in forecast[["ds", "step", "yhat"]].itertuples(index=False):
+            actual = observed.get(ds)
+            if step in task["horizons"] and actual is not None and not pd.isna(actual):
+                rows.append((dates[origin], int(step), len(train), actual, float(yhat), fit_ms))
+    return rows
+
+
+def tasks(store, country, frequencies, indicators, models, step, feature_sets=FEATURE_SETS):
+    result = []
+    for frequency in frequencies:
+        wide = store.load(indicators, country, frequency)
+        if len(wide) <= MIN_TRAIN[frequency]:
+            continue
+        features = feature_matrix(wide)
+        dates = list(wide["datetime"])
+        origins = _origins(len(wide), frequency, step)
+        for indicator in wide.columns.drop("datetime"):
+            for model in models:
+                task = {"country": country, "indicator": indicator, "frequency": frequency, "model": model,
+                        "horizons": HORIZONS[frequency], "origins": origins, "datetimes": dates}
+                if model == forecasts.PROPHET:
+                    task["history"] = wide[["datetime", indicator]].rename(columns={"datetime": "ds", indicator: "y"})
+                    task["freq"] = forecasts.PROPHET_FREQUENCIES[frequency]
+                    # Prophet only sees the series' own history
+                    result.append(dict(task, feature_set="history"))
+                    continue
+                for feature_set in feature_sets:
+                    columns = feature_columns(feature_set, features, indicator)
+                    if columns:
+                        result.append(dict(task, feature_set=feature_set, features=features[columns],
+                                           y=wide[indicator]))
+    return result
+
+
+def summarize(folds):
+    # Prophet's single fit per origin is counted under each of its horizons. MAPE blows up for
+    # series near zero (construction output and residential prices are % changes); compare MAE there.
+    grouped = folds.groupby(["country", "indicator", "frequency", "model", "feature_set", "horizon"], sort=True)
+    summary = grouped.agg(folds=("error", "size"), mae=("abs_error", "mean"), mape=("abs_pct_error", "mean"),
+                          bias=("error", "mean"), fit_seconds=("fit_ms", "sum"))
+    summary["fit_seconds"] /= 1000
+    return summary.round(3).reset_index()
+
+
+def run(path=DB_PATH, country=DEFAULT_COUNTRY, frequencies=("M", "Q"), indicators=None, models=MODELS, step=1,
+        workers=None, feature_sets=FEATURE_SETS):
+    started = time.perf_counter()
+    pending = tasks(SeriesStore(path), country, frequencies, indicators, models, step, feature_sets)
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {
+            pool.submit(_backtest_prophet if task["model"] == forecasts.PROPHET else _backtest_regression, task): task
+            for task in pending
+        }
+        for future in as_completed(futures):
+            task = futures[future]
+            rows.extend((task["country"], task["indicator"], task["frequency"], task["model"], task["feature_set"],
+                         *row) for row in future.result())
+    folds = pd.DataFrame(rows, columns=["country", "indicator", "frequency", "model", "feature_set", "origin",
+                                        "horizon", "train_rows", "actual", "predicted", "fit_ms"])
+    folds["error"] = folds["predicted"] - folds["actual"]
+    folds["abs_error"] = folds["error"].abs()
+    folds["abs_pct_error"] = (folds["abs_error"] / folds["actual"].abs().where(folds["actual"] != 0)) * 100
+    folds = folds.sort_values(["country", "indicator", "frequency", "model", "feature_set", "horizon", "origin"],
+                              ignore_index=True)
+    return folds, summarize(folds), time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtests of the regression and Prophet models")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--country", default=DEFAULT_COUNTRY)
+    parser.add_argument("--frequencies", default="M,Q")
+    parser.add_argument("--indicators", help="comma-separated indicators (default: every series of the country)")
+    parser.add_argument("--models", default=",".join(MODELS))
+    parser.add_argument("--feature-sets", default=",".join(FEATURE_SETS), help="regression feature sets")
+    parser.add_argument("--step", type=int, default=1, help="periods between fold origins")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--output", help="write per-fold results and the summary as JSON to this file")
+    args = parser.parse_args()
+
+    frequencies = [f.strip().upper() for f in args.frequencies.split(",") if f.strip()]
+    if any(f not in HORIZONS for f in frequencies):
+        parser.error(f"frequencies must be among {', '.join(HORIZONS)}")
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    if any(m not in MODELS for m in models):
+        parser.error(f"models must be among {', '.join(MODELS)}")
+    feature_sets = [f.strip() for f in args.feature_sets.split(",") if f.strip()]
+    if any(f not in FEATURE_SETS for f in feature_sets):
+        parser.error(f"feature sets must be among {', '.join(FEATURE_SETS)}")
+    indicators = [i.strip() for i in args.indicators.split(",")] if args.indicators else None
+
+    folds, summary, elapsed = run(args.db, args.country, frequencies, indicators, models, max(args.step, 1),
+                                  args.workers, feature_sets)
+    print(summary.to_string(index=False))
+    print(f"{len(folds)} folds in {elapsed:.1f} s")
+    if args.output:
+        report = {
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "runtime_seconds": round(elapsed, 3),
+            "summary": json.loads(summary.to_json(orient="records")),
+            "folds": json.loads(folds.to_json(orient="records", date_format="iso")),
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import anomalies
+import db
+import forecasts
+import reconcile
+import sections
+from db import DB_PATH
+from instrumentation import COLD_START_BUDGET_MS
+from kpi import latest_vs_previous, period_labels
+from series_store import DEFAULT_COUNTRY, SeriesStore
+
+# Headless timings of the data paths behind dashboard1.py and streamlit_app.py.
+# Each path does the same reads and transforms as the page, without Streamlit; dashboard1's
+# paths call the same sections.py builders the page does.
+# "cold" runs against an empty query result cache (connections and the OS page
+# cache stay warm); "warm" repeats the call with the cache populated, as a rerun would.
+# Run it against a synthetic_data.py database to see behaviour at scale, and keep
+# the JSON output of each version to compare.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cold start: a fresh interpreter importing what the dashboards import at the top and
+# computing the KPI cards, held to the budget the pages check their first rerun against.
+# None of HEAVY_MODULES may be loaded by then.
+DASHBOARD_IMPORTS = ["streamlit", "pandas", "plotly.express", "db", "kpi", "series_store", "chat_client",
+                     "forecasts", "instrumentation", "anomalies", "exports", "charts", "reconcile", "sections",
+                     "snapshot"]
+HEAVY_MODULES = ["prophet", "cmdstanpy", "matplotlib", "sklearn"]
+STARTUP_CODE = """
+import importlib, json, sys, time
+for name in sys.argv[3:]:
+    importlib.import_module(name)
+import benchmark
+benchmark._qoq_cards(sys.argv[1])
+print(json.dumps({
+    "elapsed_ms": (time.time() - float(sys.argv[2])) * 1000,
+    "heavy_modules": [name for name in benchmark.HEAVY_MODULES if name in sys.modules],
+}))
+"""
+
+
+def _qoq_cards(path):
+    return sections.qoq_cards(SeriesStore(path), DEFAULT_COUNTRY)
+
+
+def _mom_cards(path):
+    store = SeriesStore(path)
+    return latest_vs_previous(store.latest(["building_permits", "construction_output"], DEFAULT_COUNTRY, "M", n=2), "M")
+
+
+def _scatter(path):
+    store = SeriesStore(path)
+    return pd.concat([store.load(["building_permits"], DEFAULT_COUNTRY, frequency) for frequency in ("Q", "Y")])
+
+
+def _scatter_legacy(path):
+    return pd.concat([db.read_sql(f"SELECT * FROM {table} ORDER BY datetime", path=path)
+                      for table in ("market_data_quarterly", "market_data_yearly")])
+
+
+def _prediction_lookup(path):
+    return sections.latest_prediction(path)
+
+
+def _prediction_accuracy(path):
+    return reconcile.accuracy(path)
+
+
+def _forecast_lookup(path):
+    history = sections.prophet_history(SeriesStore(path), DEFAULT_COUNTRY)
+    forecast = forecasts.load_forecast("building_permits", DEFAULT_COUNTRY, "M", periods=6, path=path)
+    return pd.concat([history, forecast])
+
+
+def _alerts(path):
+    return anomalies.recent(limit=10, country=DEFAULT_COUNTRY, path=path)
+
+
+def _yoy_melt(path):
+    return sections.yoy_tables(SeriesStore(path), DEFAULT_COUNTRY)[1]
+
+
+def _moving_average(path):
+    return sections.moving_average_table(SeriesStore(path), DEFAULT_COUNTRY)
+
+
+def _quarterly_table(path):
+    df = db.read_sql("SELECT * FROM market_data_quarterly ORDER BY datetime DESC", path=path)
+    df["quarter_label"] = period_labels(pd.to_datetime(df["datetime"]), "Q", "%Y Q%q")
+    return df
+
+
+def _legacy_tables(path):
+    return pd.concat([db.read_sql("SELECT * FROM market_data_yoy ORDER BY year", path=path),
+                      db.read_sql("SELECT * FROM market_data_m_avg ORDER BY date", path=path)])
+
+
+DATA_PATHS = {
+    "dashboard1.qoq_cards": _qoq_cards,
+    "dashboard1.scatter": _scatter,
+    "dashboard1.prediction_lookup": _prediction_lookup,
+    "dashboard1.alerts": _alerts,
+    "dashboard1.prediction_accuracy": _prediction_accuracy,
+    "dashboard1.forecast_lookup": _forecast_lookup,
+    "dashboard1.yoy_melt": _yoy_melt,
+    "dashboard1.moving_average": _moving_average,
+    "streamlit_app.mom_cards": _mom_cards,
+    "streamlit_app.scatter": _scatter_legacy,
+    "streamlit_app.prediction_lookup": _prediction_lookup,
+    "streamlit_app.forecast_lookup": _forecast_lookup,
+    "streamlit_app.quarterly_table": _quarterly_table,
+    "streamlit_app.yoy_and_moving_average": _legacy_tables,
+}
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def _summary(samples):
+    return {"median_ms": round(statistics.median(samples), 3), "max_ms": round(max(samples), 3)}
+
+
+def time_data_paths(path, repeat):
+    cache = db.get_cache(path)
+    results = {}
+    for name, fn in DATA_PATHS.items():
+        cold, warm = [], []
+        for _ in range(repeat):
+            cache.clear()
+            elapsed, result = _timed(fn, path)
+            cold.append(elapsed)
+            warm.append(_timed(fn, path)[0])
+        results[name] = {"rows": len(result), "cold": _summary(cold), "warm": _summary(warm)}
+    return results
+
+
+def time_prophet_fit(path, repeat):
+    # The model fit the batch job runs for the dashboards' Prophet chart. Cold includes
+    # importing Prophet and loading the Stan model, so it is only measured once per process.
+    tasks = [task for task in forecasts._prophet_tasks(SeriesStore(path), DEFAULT_COUNTRY)
+             if task["label"] == "building_permits (M)"]
+    if not tasks:
+        return None
+    cold, result = _timed(forecasts._fit_prophet, tasks[0])
+    warm = [_timed(forecasts._fit_prophet, tasks[0])[0] for _ in range(repeat)]
+    return {"rows": len(result), "cold": _summary([cold]), "warm": _summary(warm)}
+
+
+def time_first_kpi(path, repeat):
+    samples, heavy = [], set()
+    for _ in range(repeat):
+        started = time.time()
+        output = subprocess.run([sys.executable, "-c", STARTUP_CODE, os.path.abspath(path), repr(started),
+                                 *DASHBOARD_IMPORTS], capture_output=True, text=True, check=True, cwd=BASE_DIR).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        samples.append(result["elapsed_ms"])
+        heavy.update(result["heavy_modules"])
+    summary = _summary(samples)
+    return {"cold": summary, "budget_ms": COLD_START_BUDGET_MS, "heavy_modules": sorted(heavy),
+            "within_budget": summary["max_ms"] <= COLD_START_BUDGET_MS and not heavy}
+
+
+def dataset(path):
+    conn = sqlite3.connect(path)
+    try:
+        counts = dict(conn.execute("SELECT frequency, COUNT(*) FROM series GROUP BY frequency").fetchall())
+        values = conn.execute("SELECT COUNT(*) FROM series_values").fetchone()[0]
+        schema_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    return {"path": os.path.abspath(path), "bytes": os.path.getsize(path), "schema_version": schema_version,
+            "series": counts, "series_values": values}
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=BASE_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(path=DB_PATH, repeat=5, prophet=True):
+    results = {"first_kpi": time_first_kpi(path, repeat)}
+    results.update(time_data_paths(path, repeat))
+    if prophet:
+        results["prophet_fit"] = time_prophet_fit(path, repeat)
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _revision(),
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__,
+                        "sqlite": sqlite3.sqlite_version},
+        "dataset": dataset(path),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the dashboards' data paths, cold and warm, as JSON")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-prophet", action="store_true", help="skip the Prophet fit timing")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--check-budget", action="store_true",
+                        help="exit with status 1 when time to first KPI is over budget or loads a heavy module")
+    args = parser.parse_args()
+
+    results = benchmark(args.db, args.repeat, not args.no_prophet)
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    if args.check_budget and not results["results"]["first_kpi"]["within_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import db
+from db import DB_PATH
+
+# Point budget and figure cache for the dashboards' Plotly charts.
+# Long series are downsampled with LTTB (largest triangle three buckets), which keeps
+# peaks, troughs and turning points, before they are serialized to the browser. When a
+# series is over budget a range slider appears, and the selected range is re-read at full
+# detail and downsampled again. Built figures are cached per data version and chart
+# parameters, so flipping a radio or selectbox back and forth does not rebuild them.
+MAX_POINTS = 1000
+MAX_CACHED_FIGURES = 32
+
+
+def lttb(x, y, threshold):
+    # Indices of the `threshold` points that best preserve the visual shape of (x, y)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # First and last points are always kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        # Average of the next bucket is the third corner of the triangle
+        avg_x = x[end:next_end].mean() if next_end > end else x[-1]
+        avg_y = y[end:next_end].mean() if next_end > end else y[-1]
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y, buckets):
+    # Indices of the minimum and maximum of each bucket; cheaper than LTTB, keeps every extreme
+    n = len(y)
+    if 2 * buckets >= n:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    selected = set()
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            selected.add(start + int(np.nanargmin(y[start:end])))
+            selected.add(start + int(np.nanargmax(y[start:end])))
+    return np.array(sorted(selected))
+
+
+def downsample(df, x, columns, max_points=MAX_POINTS, method="lttb"):
+    # Rows of df kept for plotting: the union of the points each column needs, in order
+    if len(df) <= max_points:
+        return df
+    xs = df[x]
+    if not pd.api.types.is_numeric_dtype(xs):
+        xs = pd.to_datetime(xs).astype("datetime64[ns]").astype("int64")
+    xs = xs.to_numpy(dtype=float)
+    per_column = max(max_points // len(columns), 3)
+    keep = set()
+    for column in columns:
+        positions = np.flatnonzero(df[column].notna().to_numpy())
+        values = df[column].to_numpy(dtype=float)[positions]
+        if method == "minmax":
+            chosen = minmax(values, per_column // 2)
+        else:
+            chosen = lttb(xs[positions], values, per_column)
+        keep.update(positions[chosen].tolist())
+    return df.iloc[sorted(keep)]
+
+
+def zoom_range(label, datetimes, key, max_points=MAX_POINTS):
+    # Date range slider, only for series that are over the point budget.
+    # Returns (start, end) as strings for SeriesStore.load, or (None, None) for the full range.
+    datetimes = pd.to_datetime(pd.Series(datetimes)).dropna()
+    if len(datetimes) <= max_points:
+        return None, None
+    first, last = datetimes.min().to_pydatetime(), datetimes.max().to_pydatetime()
+    start, end = st.slider(label, min_value=first, max_value=last, value=(first, last), key=key, format="YYYY-MM-DD")
+    if (start, end) == (first, last):
+        return None, None
+    return pd.Timestamp(start).strftime("%Y-%m-%d %H:%M:%S"), pd.Timestamp(end).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class FigureCache:
+    def __init__(self, max_entries=MAX_CACHED_FIGURES):
+        self.max_entries = max_entries
+        self._figures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            if key in self._figures:
+                self._figures.move_to_end(key)
+                return self._figures[key]
+        figure = build()
+        with self._lock:
+            self._figures[key] = figure
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return figure
+
+
+_figures = FigureCache()
+
+
+def cached_figure(key, build, path=DB_PATH):
+    # Figures are shared read-only between sessions; a new data version builds new ones.
+    # Streamlit serializes the figure without modifying it, so one object can be reused.
+    return _figures.get((db.data_version(path),) + tuple(key), build)
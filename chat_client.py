@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+# Non-blocking client for the n8n assistant webhook.
+# Requests run on a shared thread pool over a pooled requests.Session, so the
+# dashboard keeps rendering while a reply is pending, and partial replies are
+# shown as they stream in. Replies can optionally be cached per conversation by
+# setting N8N_CHAT_CACHE_TTL (seconds); the cache is off by default.
+MAX_WORKERS = 4
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 300
+CACHE_TTL_SECONDS = int(os.environ.get("N8N_CHAT_CACHE_TTL", "0"))
+MAX_CACHED_REPLIES = 128
+MAX_RENDERED_MESSAGES = 20
+POLL_INTERVAL_SECONDS = 0.5
+GREETING = "Hi! How can I assist you today?"
+
+
+class PendingReply:
+    def __init__(self, prompt, conversation_id=None):
+        self.prompt = prompt
+        self.conversation_id = conversation_id
+        self.chunks = []
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def text(self):
+        if self.error:
+            return f"Error connecting to n8n: {self.error}"
+        return "".join(self.chunks)
+
+
+class N8NChatClient:
+    def __init__(self, url, max_workers=MAX_WORKERS, cache_ttl=CACHE_TTL_SECONDS):
+        self.url = url
+        self.cache_ttl = cache_ttl
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="n8n-chat")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        if not self.cache_ttl:
+            return None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            stored_at, text = entry
+            if time.monotonic() - stored_at > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return text
+
+    def _store(self, key, text):
+        if not self.cache_ttl:
+            return
+        with self._lock:
+            self._cache[key] = (time.monotonic(), text)
+            while len(self._cache) > MAX_CACHED_REPLIES:
+                self._cache.popitem(last=False)
+
+    def submit(self, prompt, conversation_id=None):
+        # Cached replies are only reused within the conversation that asked for them
+        reply = PendingReply(prompt, conversation_id)
+        cached = self._cached((conversation_id, prompt.strip()))
+        if cached is not None:
+            reply.chunks.append(cached)
+            reply.done.set()
+        else:
+            self.executor.submit(self._request, reply)
+        return reply
+
+    def _request(self, reply):
+        try:
+            with self.session.post(self.url, json={"message": reply.prompt}, headers={"Content-Type": "application/json"},
+                                   timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=True) as response:
+                response.raise_for_status()
+                response.encoding = response.encoding or "utf-8"
+                for chunk in response.iter_content(chunk_size=1024, decode_unicode=True):
+                    reply.chunks.append(chunk)
+            self._store((reply.conversation_id, reply.prompt.strip()), reply.text)
+        except requests.exceptions.RequestException as e:
+            reply.error = str(e)
+        finally:
+            reply.done.set()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = N8NChatClient(url)
+        return _clients[url]
+
+
+def _chat_panel(client):
+    messages = st.session_state.messages
+    pending = st.session_state.get("pending_reply")
+    if pending is not None and pending.done.is_set():
+        messages.append({"role": "assistant", "content": pending.text})
+        st.session_state.pending_reply = None
+        # Full rerun so the fragment is re-registered without polling
+        st.rerun()
+
+    chat_container = st.container(height=400)
+    with chat_container:
+        hidden = len(messages) - MAX_RENDERED_MESSAGES
+        if hidden > 0:
+            st.caption(f"{hidden} earlier messages not shown")
+        for message in messages[-MAX_RENDERED_MESSAGES:]:
+            with st.chat_message(message["role"]):
+                st.write(message["content"])
+        if pending is not None:
+            with st.chat_message("assistant"):
+                # Partial reply streamed so far
+                st.write(pending.text + " …" if pending.chunks else "Processing your request...")
+
+    if prompt := st.chat_input("Type your message here", key="sidebar_chat_input", disabled=pending is not None):
+        messages.append({"role": "user", "content": prompt})
+        reply = client.submit(prompt, st.session_state.conversation_id)
+        if reply.done.is_set():
+            # Served from the reply cache, no need to start polling
+            messages.append({"role": "assistant", "content": reply.text})
+            st.rerun(scope="fragment")
+        st.session_state.pending_reply = reply
+        # Full rerun so the fragment is re-registered with polling
+        st.rerun()
+
+
+def render_sidebar_chat(url):
+    if "messages" not in st.session_state:
+        st.session_state.messages = [{"role": "assistant", "content": GREETING}]
+    if "conversation_id" not in st.session_state:
+        st.session_state.conversation_id = uuid.uuid4().hex
+    client = get_client(url)
+    # Only the chat panel reruns while a reply is pending; the main content is left alone
+    run_every = POLL_INTERVAL_SECONDS if st.session_state.get("pending_reply") is not None else None
+    with st.sidebar:
+        st.header("Chat with Assistant")
+        st.fragment(_chat_panel, run_every=run_every)(client)
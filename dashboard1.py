@@ -1,10 +1,22 @@
+import time
+
+# Taken before the imports, so the first rerun's KPI timing includes them
+STARTED = time.perf_counter()
+
 import streamlit as st
-import requests
-import sqlite3
 import pandas as pd
-import plotly.express as px
-from prophet import Prophet
-from prophet.plot import plot_plotly
+from kpi import period_labels
+from series_store import DEFAULT_COUNTRY, FREQUENCIES, SeriesStore
+from charts import cached_figure, zoom_range
+from anomalies import recent as recent_anomalies
+from chat_client import render_sidebar_chat
+from exports import download_buttons, frame_chunks
+from forecasts import load_forecast
+from instrumentation import Recorder
+from reconcile import ROLLING_WINDOW, accuracy as prediction_accuracy
+from sections import (latest_prediction, moving_average_figure, moving_average_table, prophet_figure, prophet_history,
+                      qoq_cards, scatter_figure, yoy_figure, yoy_tables)
+from snapshot import current as current_snapshot
 
 # Must be the first Streamlit command
 st.set_page_config(layout="wide")
@@ -19,39 +31,21 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Every indicator series is read from the long-format store
+COUNTRY = DEFAULT_COUNTRY
+store = SeriesStore()
+# Tables and figures pre-rendered by snapshot.py for this data version, if it has run;
+# every lookup falls back to building the artifact live
+snap = current_snapshot(country=COUNTRY)
+# Per-section timings for this rerun; add ?debug=1 to the URL to see them
+recorder = Recorder("dashboard1", STARTED)
+
 # Your n8n production webhook URL
 N8N_WEBHOOK_URL = "https://f089-62-250-42-200.ngrok-free.app/webhook/f189b9b1-314e-4bbc-a8e4-105912501679"
 
-# Initialize session state to store chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hi! How can I assist you today?"}]
-
-# Sidebar for the chat
-with st.sidebar:
-    st.header("Chat with Assistant")
-    chat_container = st.container(height=400)
-    with chat_container:
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.write(message["content"])
-    if prompt := st.chat_input("Type your message here", key="sidebar_chat_input"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with chat_container:
-            with st.chat_message("user"):
-                st.write(prompt)
-            with st.chat_message("assistant"):
-                with st.spinner("Processing your request... This may take up to 30 seconds."):
-                    try:
-                        payload = {"message": prompt}
-                        headers = {"Content-Type": "application/json"}
-                        response = requests.post(N8N_WEBHOOK_URL, json=payload, headers=headers, timeout=300)
-                        response.raise_for_status()
-                        assistant_response = response.text
-                    except requests.exceptions.RequestException as e:
-                        assistant_response = f"Error connecting to n8n: {str(e)}"
-                        st.write(f"Error: {assistant_response}")
-                st.write(assistant_response)
-                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
+# Sidebar chat; the webhook call runs in the background so the page keeps rendering
+with recorder.section("chat"):
+    render_sidebar_chat(N8N_WEBHOOK_URL)
 
 # ----------------- MAIN CONTENT -----------------
 st.markdown("""
@@ -62,42 +56,122 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Connect to database
-conn = sqlite3.connect("market_data.db")
+# Section boxes in page order. The KPI cards and forecast metrics are filled first;
+# the chart sections fill their boxes afterwards, as fragments that rerun on their own
+# when their widgets change instead of rerunning the whole page
+qoq_box, alerts_box, scatter_box, forecast_box, prophet_box, yoy_box, ma_box = (st.container(border=True) for _ in range(7))
+
+
+# Scatter Plot section
+@st.fragment
+def scatter_section():
+    with recorder.fragment("scatter"):
+        col_select1, col_select2 = st.columns([1, 2])
+        with col_select1:
+            granularity = st.radio("Select data granularity:", ["Quarterly", "Yearly"], horizontal=True)
+        frequency = FREQUENCIES[granularity]
+        with col_select2:
+            st.markdown(
+                """
+                <style>
+                div[data-testid="stSelectbox"] select {
+                    background-color: #cfcccc;
+                    border-radius: 5px;
+                    padding: 5px;
+                }
+                </style>
+                """,
+                unsafe_allow_html=True
+            )
+            kpi_options = list(store.catalog(COUNTRY, frequency)["indicator"])
+            kpi = st.selectbox("Select indicator to plot:", kpi_options)
+        df = snap.table(f"scatter_{frequency}_{kpi}", lambda: store.load([kpi], COUNTRY, frequency))
+        # Long series get a range slider; the chosen range is re-read at full detail
+        start, end = zoom_range("Zoom to dates", df["datetime"], key=f"scatter_zoom_{frequency}_{kpi}")
+        if start is not None:
+            df = store.load([kpi], COUNTRY, frequency, start, end)
+        st.subheader(f"{kpi.replace('_', ' ').title()} Over Time ({granularity})")
+
+        def build():
+            return cached_figure(("scatter", COUNTRY, kpi, frequency, start, end), lambda: scatter_figure(df, kpi))
+        # Zoomed ranges are never pre-rendered
+        fig = build() if start is not None else snap.figure(f"scatter_{frequency}_{kpi}", build)
+        st.plotly_chart(fig, use_container_width=True)
+        with st.expander("🔍 View Raw Data Table"):
+            st.dataframe(df, use_container_width=True)
+            # Files are only written when a button is clicked, then reused for this data version
+            download_buttons("Download Data", "scatter", (COUNTRY, kpi, frequency, start, end), lambda: frame_chunks(df),
+                             f"scatter_data_{granularity.lower()}")
+            download_buttons(f"Download all {granularity.lower()} indicators", "all_series", (COUNTRY, frequency),
+                             lambda: store.iter_long(None, COUNTRY, frequency), f"all_indicators_{granularity.lower()}")
+
+
+# Prophet Forecast section
+@st.fragment
+def prophet_section():
+    with recorder.fragment("prophet"):
+        st.markdown("### 📅 Building Permits Forecast (Prophet)")
+        periods = st.slider("Forecast months", 1, 12, 6)
+        # Precomputed by forecasts.py; only rows are read here, nothing is fitted
+        forecast = snap.table(f"forecast_{periods}", lambda: load_forecast("building_permits", COUNTRY, "M", periods=periods))
+        if forecast.empty:
+            st.warning("No forecasts available yet. Run forecasts.py to compute them.")
+        else:
+            history = snap.table("prophet_history", lambda: prophet_history(store, COUNTRY))
+            st.subheader(f"{periods}-Month Forecast")
+            fig_prophet = snap.figure(f"prophet_{periods}", lambda: cached_figure(
+                ("prophet", COUNTRY, "building_permits", periods), lambda: prophet_figure(history, forecast)))
+            st.plotly_chart(fig_prophet, use_container_width=True)
+            with st.expander("🔍 View Forecast Data"):
+                forecast_display = forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+                st.dataframe(forecast_display, use_container_width=True)
+                download_buttons("Download Forecast Data", "prophet_forecast", (COUNTRY, periods),
+                                 lambda: frame_chunks(forecast_display), f"prophet_forecast_{periods}_months")
+
+
+# Year-over-Year Growth Section
+@st.fragment
+def yoy_section():
+    with recorder.fragment("yoy"):
+        st.markdown("### 📊 Year-over-Year Growth")
+        df_yoy, df_yoy_melt = snap.tables(["yoy", "yoy_melt"], lambda: yoy_tables(store, COUNTRY))
+        fig_yoy = snap.figure("yoy", lambda: cached_figure(("yoy", COUNTRY), lambda: yoy_figure(df_yoy_melt)))
+        st.plotly_chart(fig_yoy, use_container_width=True)
+        with st.expander("🔍 View Raw Data Table"):
+            st.dataframe(df_yoy, use_container_width=True)
+            download_buttons("Download YoY Data", "yoy", (COUNTRY,), lambda: frame_chunks(df_yoy), "yoy_growth_data")
+
+
+# Moving Average Section
+@st.fragment
+def moving_average_section():
+    with recorder.fragment("moving_average"):
+        st.markdown("### 🧮 Construction Output – 3-Month Moving Average")
+        df_ma = snap.table("moving_average", lambda: moving_average_table(store, COUNTRY))
+        # The average needs the preceding months, so zooming slices the full-detail frame
+        start, end = zoom_range("Zoom to dates", df_ma["date"], key="ma_zoom")
+        if start is not None:
+            df_ma = df_ma[(df_ma["date"] >= start) & (df_ma["date"] <= end)]
+
+        def build():
+            return cached_figure(("moving_average", COUNTRY, start, end), lambda: moving_average_figure(df_ma))
+        fig_ma = build() if start is not None else snap.figure("moving_average", build)
+        st.plotly_chart(fig_ma, use_container_width=True)
+
 
 # Visualization section (QoQ cards)
-with st.container(border=True):
+with recorder.section("qoq_cards"), qoq_box:
     st.subheader("Quarter-over-Quarter Changes")
-    df_quarterly = pd.read_sql("SELECT * FROM market_data_quarterly ORDER BY datetime DESC", conn)
-    df_quarterly['datetime'] = pd.to_datetime(df_quarterly['datetime'])
-    metrics = {
-        'Building Permits': 'building_permits',
-        'Construction Output': 'construction_output',
-        'Price-to-Rent Ratio': 'price_to_rent_ratio',
-        'Residential Prices': 'residential_prices'
-    }
+    # All series in one vectorized pass; one row per indicator, in catalog order
+    df_kpi = snap.table("qoq_cards", lambda: qoq_cards(store, COUNTRY))
     qoq_changes = {}
     quarters_compared = {}
-    for display_name, col in metrics.items():
-        df_feature = df_quarterly[['datetime', col]].dropna(subset=[col]).sort_values('datetime', ascending=False)
-        if len(df_feature) >= 2:
-            latest = df_feature.iloc[0]
-            previous = df_feature.iloc[1]
-            if previous[col] != 0:
-                change = ((latest[col] - previous[col]) / previous[col]) * 100
-                qoq_changes[display_name] = round(change, 2)
-                latest_quarter = latest['datetime'].to_period('Q').strftime('%YQ%q')
-                prev_quarter = previous['datetime'].to_period('Q').strftime('%YQ%q')
-                quarters_compared[display_name] = f"{latest_quarter} vs {prev_quarter}"
-            else:
-                qoq_changes[display_name] = None
-                quarters_compared[display_name] = "N/A"
-        else:
-            qoq_changes[display_name] = None
-            quarters_compared[display_name] = "N/A"
+    for row in df_kpi.itertuples(index=False):
+        qoq_changes[row.name] = None if pd.isna(row.change_pct) else row.change_pct
+        quarters_compared[row.name] = row.comparison
     cols = st.columns(4)
     for idx, (display_name, change) in enumerate(qoq_changes.items()):
-        with cols[idx]:
+        with cols[idx % 4]:
             if change is not None:
                 color = "green" if change >= 0 else "red"
                 sign = "+" if change >= 0 else ""
@@ -122,107 +196,70 @@ with st.container(border=True):
                     """,
                     unsafe_allow_html=True
                 )
-
-# Scatter Plot section
-with st.container(border=True):
-    col_select1, col_select2 = st.columns([1, 2])
-    with col_select1:
-        granularity = st.radio("Select data granularity:", ["Quarterly", "Yearly"], horizontal=True)
-    table = "market_data_quarterly" if granularity == "Quarterly" else "market_data_yearly"
-    df = pd.read_sql(f"SELECT * FROM {table}", conn)
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    with col_select2:
-        st.markdown(
-            """
-            <style>
-            div[data-testid="stSelectbox"] select {
-                background-color: #cfcccc;
-                border-radius: 5px;
-                padding: 5px;
-            }
-            </style>
-            """,
-            unsafe_allow_html=True
-        )
-        kpi_options = [col for col in df.columns if col not in ["datetime", "year", "quarter"]]
-        kpi = st.selectbox("Select indicator to plot:", kpi_options)
-    st.subheader(f"{kpi.replace('_', ' ').title()} Over Time ({granularity})")
-    fig = px.scatter(df, x="datetime", y=kpi, title=f"{kpi.replace('_', ' ').title()} Over Time",
-                     labels={"datetime": "Date", kpi: kpi.replace('_', ' ').title()}, color_discrete_sequence=["#008080"])
-    fig.update_traces(mode='lines+markers', hovertemplate='Date: %{x|%Y-%m-%d}<br>Value: %{y:.2f}<extra></extra>')
-    fig.update_layout(hovermode="x unified", yaxis=dict(tickformat=".2f", fixedrange=False))
-    st.plotly_chart(fig, use_container_width=True)
-    with st.expander("🔍 View Raw Data Table"):
-        st.dataframe(df, use_container_width=True)
-        st.download_button(label="Download Data", data=df.to_csv(index=False), file_name=f"scatter_data_{granularity.lower()}.csv", mime="text/csv")
+recorder.first_kpi()
 
 # Building Permits Forecast Section (Restored with Box)
-with st.container(border=True):
+with recorder.section("forecast_metrics"), forecast_box:
     st.markdown("### 📈 Building Permits Forecast Based on Residential Property Prices")
-    df_pred = pd.read_sql("SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1", conn)
+    df_pred = snap.table("prediction", latest_prediction)
     if not df_pred.empty:
-        actual = int(df_pred["actual_permits"].values[0])
+        actual = df_pred["actual_permits"].values[0]
         predicted = int(df_pred["predicted_permits"].values[0])
         quarter_str = pd.to_datetime(df_pred["current_quarter"].values[0]).to_period("Q").strftime("Q%q %Y")
         colf1, colf2 = st.columns(2)
         with colf1:
-            st.metric(label=f"📌 {quarter_str} – Building Permits", value=f"{actual:,}")
+            st.metric(label=f"📌 {quarter_str} – Building Permits", value=f"{int(actual):,}" if pd.notna(actual) else "Pending")
         with colf2:
             st.metric(label=f"📌 Next Quarter – Predicted Permits", value=f"{predicted:,}")
+        # Maintained by reconcile.py as actuals arrive; one row per model version
+        df_accuracy = snap.table("accuracy", prediction_accuracy)
+        if not df_accuracy.empty:
+            with st.expander("🎯 Prediction Accuracy"):
+                st.dataframe(pd.DataFrame({
+                    "Model Version": df_accuracy["model_version"],
+                    "Predictions": df_accuracy["predictions"],
+                    "MAE": df_accuracy["mae"].round(0),
+                    "MAPE (%)": df_accuracy["mape"].round(2),
+                    "Bias": df_accuracy["bias"].round(0),
+                    f"MAE (last {ROLLING_WINDOW})": df_accuracy["rolling_mae"].round(0),
+                    f"MAPE (last {ROLLING_WINDOW}, %)": df_accuracy["rolling_mape"].round(2),
+                    f"Bias (last {ROLLING_WINDOW})": df_accuracy["rolling_bias"].round(0),
+                }), use_container_width=True, hide_index=True)
+                st.caption("Bias is predicted minus actual permits: positive values mean over-prediction")
     else:
         st.warning("No predictions available yet.")
 
-# Prophet Forecast section
-with st.container(border=True):
-    st.markdown("### 📅 Building Permits Forecast (Prophet)")
-    df_prophet = pd.read_sql("SELECT datetime, building_permits FROM market_data_monthly WHERE building_permits IS NOT NULL ORDER BY datetime", conn)
-    df_prophet = df_prophet.rename(columns={"datetime": "ds", "building_permits": "y"})
-    df_prophet['ds'] = pd.to_datetime(df_prophet['ds'])
-    m = Prophet()
-    m.fit(df_prophet)
-    periods = st.slider("Forecast months", 1, 12, 6)
-    future = m.make_future_dataframe(periods=periods, freq="M")
-    forecast = m.predict(future)
-    st.subheader(f"{periods}-Month Forecast")
-    fig_prophet = plot_plotly(m, forecast)
-    fig_prophet.update_traces(selector=dict(name="y"), hovertemplate='Date: %{x|%Y-%m-%d}<br>Value: %{y:.2f}<extra></extra>')
-    fig_prophet.update_traces(selector=dict(name="yhat"), hovertemplate='Date: %{x|%Y-%m-%d}<br>Forecast: %{y:.2f}<extra></extra>')
-    fig_prophet.update_traces(selector=dict(name="yhat_upper"), hovertemplate='Date: %{x|%Y-%m-%d}<br>Upper: %{y:.2f}<extra></extra>')
-    fig_prophet.update_traces(selector=dict(name="yhat_lower"), hovertemplate='Date: %{x|%Y-%m-%d}<br>Lower: %{y:.2f}<extra></extra>')
-    fig_prophet.update_layout(hovermode="x unified", yaxis=dict(tickformat=".2f", fixedrange=False))
-    st.plotly_chart(fig_prophet, use_container_width=True)
-    with st.expander("🔍 View Forecast Data"):
-        forecast_display = forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
-        st.dataframe(forecast_display, use_container_width=True)
-        st.download_button(label="Download Forecast Data", data=forecast_display.to_csv(index=False), file_name=f"prophet_forecast_{periods}_months.csv", mime="text/csv")
+# Anomaly alerts, scored by anomalies.py as points are ingested
+with recorder.section("alerts"), alerts_box:
+    st.markdown("### 🚨 Anomaly Alerts")
+    df_alerts = snap.table("alerts", lambda: recent_anomalies(limit=10, country=COUNTRY))
+    if df_alerts.empty:
+        st.info("No anomalies recorded. Run anomalies.py to score the series.")
+    else:
+        frequency_names = {frequency: name for name, frequency in FREQUENCIES.items()}
+        dates = pd.to_datetime(df_alerts["datetime"])
+        periods = pd.Series(index=df_alerts.index, dtype=object)
+        for frequency, rows in df_alerts.groupby("frequency").groups.items():
+            periods[rows] = period_labels(dates[rows], frequency)
+        st.dataframe(pd.DataFrame({
+            "Period": periods,
+            "Indicator": df_alerts["name"],
+            "Frequency": df_alerts["frequency"].map(frequency_names),
+            "Value": df_alerts["value"].round(2),
+            "Change": df_alerts["change"].round(2),
+            "Expected Change": df_alerts["expected_change"].round(2),
+            "Score": df_alerts["score"].round(1),
+        }), use_container_width=True, hide_index=True)
+        st.caption("Score: how far the change is from recent behaviour, in robust standard deviations")
 
-# Year-over-Year Growth Section
-with st.container(border=True):
-    st.markdown("### 📊 Year-over-Year Growth")
-    df_yoy = pd.read_sql("SELECT * FROM market_data_yoy", conn)
-    df_yoy_melt = df_yoy.melt(id_vars="year", value_vars=["permits_yoy_pct", "prices_yoy_pct", "ratio_yoy_pct", "output_yoy_pct"], var_name="Metric", value_name="YoY Growth (%)")
-    df_yoy_melt["Metric"] = df_yoy_melt["Metric"].replace({
-        "permits_yoy_pct": "Building Permits",
-        "prices_yoy_pct": "Residential Prices",
-        "ratio_yoy_pct": "Price-to-Rent Ratio",
-        "output_yoy_pct": "Construction Output"
-    })
-    fig_yoy = px.bar(df_yoy_melt, x="year", y="YoY Growth (%)", color="Metric", barmode="group", text="YoY Growth (%)", color_discrete_sequence=px.colors.qualitative.Set2)
-    fig_yoy.update_traces(textposition="outside")
-    fig_yoy.update_layout(yaxis_tickformat=".2f", xaxis_title="Year", yaxis_title="% Change")
-    st.plotly_chart(fig_yoy, use_container_width=True)
-    with st.expander("🔍 View Raw Data Table"):
-        st.dataframe(df_yoy, use_container_width=True)
-        st.download_button(label="Download YoY Data", data=df_yoy.to_csv(index=False), file_name="yoy_growth_data.csv", mime="text/csv")
+# Chart sections, once the cards are on screen
+with scatter_box:
+    scatter_section()
+with prophet_box:
+    prophet_section()
+with yoy_box:
+    yoy_section()
+with ma_box:
+    moving_average_section()
 
-# Moving Average Section
-with st.container(border=True):
-    st.markdown("### 🧮 Construction Output – 3-Month Moving Average")
-    df_ma = pd.read_sql("SELECT * FROM market_data_m_avg", conn)
-    fig_ma = px.line(df_ma, x="date", y=["current_output", "output_3mo_avg"], labels={"value": "Construction Output", "date": "Date"},
-                     title="Construction Output vs 3-Month Moving Average", color_discrete_map={"current_output": "#1f77b4", "output_3mo_avg": "#ff7f0e"})
-    fig_ma.update_layout(legend_title_text="Legend")
-    st.plotly_chart(fig_ma, use_container_width=True)
-
-# Close the database connection
-conn.close()
+recorder.finish()
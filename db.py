@@ -0,0 +1,132 @@
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+import pandas as pd
+
+# Shared read-only access to market_data.db for the dashboards.
+# Connections are pooled per process and query results are cached by SQL text
+# and a version stamp of the database files, so a rerun only touches SQLite
+# after the database has actually changed.
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_data.db")
+POOL_SIZE = 4
+MAX_CACHED_RESULTS = 64
+
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+class QueryCache:
+    def __init__(self, pool, max_entries=MAX_CACHED_RESULTS):
+        self.pool = pool
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        # Main file plus WAL file, so commits that have not been checkpointed still count.
+        # A missing and an empty WAL are the same: the first reader after a checkpoint
+        # creates an empty one without changing any data.
+        stamp = []
+        for suffix in ("", "-wal"):
+            try:
+                st = os.stat(self.pool.path + suffix)
+            except FileNotFoundError:
+                st = None
+            stamp.append((st.st_mtime_ns, st.st_size) if st is not None and st.st_size else None)
+        return tuple(stamp)
+
+    def read_sql(self, sql, params=()):
+        version = self.version()
+        key = (sql, tuple(params))
+        with self._lock:
+            if version != self._version:
+                self._results.clear()
+                self._version = version
+            elif key in self._results:
+                self._results.move_to_end(key)
+                _count(len(self._results[key]), hit=True)
+                return self._results[key].copy()
+        with self.pool.connection() as conn:
+            df = pd.read_sql(sql, conn, params=params or None)
+        _count(len(df), hit=False)
+        with self._lock:
+            if version == self._version:
+                self._results[key] = df
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return df.copy()
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._version = None
+
+
+# Per-thread read counters; every Streamlit session reruns on its own thread,
+# so the difference between two snapshots belongs to the code in between
+_stats = threading.local()
+
+
+def _count(rows, hit):
+    _stats.rows = getattr(_stats, "rows", 0) + rows
+    if hit:
+        _stats.hits = getattr(_stats, "hits", 0) + 1
+    else:
+        _stats.misses = getattr(_stats, "misses", 0) + 1
+
+
+def thread_stats():
+    return getattr(_stats, "rows", 0), getattr(_stats, "hits", 0), getattr(_stats, "misses", 0)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path=DB_PATH):
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = QueryCache(ConnectionPool(path))
+        return _caches[path]
+
+
+def read_sql(sql, params=(), path=DB_PATH):
+    return get_cache(path).read_sql(sql, params)
+
+
+def iter_sql(sql, params=(), chunksize=50000, path=DB_PATH):
+    # Uncached chunked read for large exports; holds one pooled connection until exhausted
+    with get_cache(path).pool.connection() as conn:
+        yield from pd.read_sql(sql, conn, params=params or None, chunksize=chunksize)
+
+
+def data_version(path=DB_PATH):
+    return get_cache(path).version()
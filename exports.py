@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import os
+import threading
+from functools import partial
+
+import streamlit as st
+
+import db
+from db import DB_PATH
+
+# Data downloads for the dashboards. A download button only registers a callable, so
+# nothing is serialized until somebody clicks it. The file is then written chunk by
+# chunk (CSV, gzip-compressed CSV or Parquet row groups) into an on-disk cache keyed by
+# data version and export parameters, and every later click, from any session, reuses it.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPORT_DIR = os.environ.get("DASHBOARD_EXPORT_DIR", os.path.join(BASE_DIR, ".export_cache"))
+CHUNK_ROWS = 50000
+MAX_EXPORT_FILES = 64
+# Button title, file extension and mime type of each format
+FORMATS = {
+    "csv": ("CSV", ".csv", "text/csv"),
+    "csv.gz": ("CSV (gzip)", ".csv.gz", "application/gzip"),
+    "parquet": ("Parquet", ".parquet", "application/vnd.apache.parquet"),
+}
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def frame_chunks(df, chunk_rows=CHUNK_ROWS):
+    # Slices of an in-memory frame; always at least one, so empty frames still get a header
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _write_csv(chunks, f):
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(f, index=False, header=header)
+        header = False
+
+
+def write_csv(chunks, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        _write_csv(chunks, f)
+
+
+def write_csv_gz(chunks, path):
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+        _write_csv(chunks, f)
+
+
+def write_parquet(chunks, path):
+    # One row group per chunk; later chunks are cast to the first chunk's schema
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            else:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+        if writer is None:
+            pq.write_table(pa.table({}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+WRITERS = {"csv": write_csv, "csv.gz": write_csv_gz, "parquet": write_parquet}
+
+
+def _lock_for(target):
+    with _locks_lock:
+        return _locks.setdefault(target, threading.Lock())
+
+
+def _evict():
+    # Oldest files go first; exports of an older data version are never hit again
+    files = [os.path.join(EXPORT_DIR, name) for name in os.listdir(EXPORT_DIR) if not name.endswith(".tmp")]
+    files.sort(key=lambda f: os.path.getmtime(f) if os.path.exists(f) else 0)
+    for f in files[:max(len(files) - MAX_EXPORT_FILES, 0)]:
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+
+
+def export_file(name, params, fmt, chunks, path=DB_PATH):
+    # Path of the export at the current data version; `chunks` is only called on a cache miss
+    digest = hashlib.sha1(repr((db.data_version(path), name, tuple(params), fmt)).encode()).hexdigest()[:20]
+    target = os.path.join(EXPORT_DIR, f"{name}-{digest}{FORMATS[fmt][1]}")
+    with _lock_for(target):
+        if os.path.exists(target):
+            os.utime(target)
+            return target
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            WRITERS[fmt](chunks(), tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _evict()
+    return target
+
+
+def open_export(name, params, fmt, chunks, path=DB_PATH):
+    # Binary handle on the cached file; the download button reads it when clicked and drops it
+    return open(export_file(name, params, fmt, chunks, path), "rb")
+
+
+def download_buttons(label, name, params, chunks, file_stem, path=DB_PATH):
+    # One button per format. Clicking only downloads: the page does not rerun.
+    st.caption(label)
+    for column, (fmt, (title, extension, mime)) in zip(st.columns(len(FORMATS)), FORMATS.items()):
+        with column:
+            st.download_button(title, data=partial(open_export, name, params, fmt, chunks, path),
+                               file_name=file_stem + extension, mime=mime, on_click="ignore",
+                               key=f"{name}_export_{fmt}")
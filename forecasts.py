@@ -0,0 +1,274 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import pandas as pd
+import plotly.graph_objects as go
+
+import db
+import series_store
+from db import DB_PATH
+from ingest import DATE_FORMAT
+from kpi import next_quarter
+from series_store import DEFAULT_COUNTRY, SeriesStore
+
+# Offline batch forecasting. Every series in the store gets a Prophet fit in a process
+# pool, the next-quarter building permits regression from the notebook is refitted,
+# and the results are written to the forecasts table. A series whose input hash is
+# unchanged since its last run is skipped, so the dashboards only ever read rows.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecasts (
+    series_id INTEGER NOT NULL REFERENCES series (series_id),
+    model TEXT NOT NULL,
+    datetime TEXT NOT NULL,
+    step INTEGER NOT NULL,
+    yhat REAL,
+    yhat_lower REAL,
+    yhat_upper REAL,
+    PRIMARY KEY (series_id, model, datetime)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS forecast_runs (
+    series_id INTEGER NOT NULL REFERENCES series (series_id),
+    model TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    fitted_at TEXT NOT NULL,
+    PRIMARY KEY (series_id, model)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS building_permit_predictions (
+    current_quarter TEXT PRIMARY KEY,
+    residential_price REAL,
+    predicted_permits INTEGER,
+    actual_permits INTEGER,
+    model_version TEXT NOT NULL DEFAULT 'notebook'
+) WITHOUT ROWID;
+"""
+
+# Steps ahead stored per frequency; the dashboards slice shorter horizons from these rows
+HORIZONS = {"M": 12, "Q": 4}
+PROPHET_FREQUENCIES = {"M": "ME", "Q": "QE"}
+PROPHET = "prophet"
+REGRESSION = "linear_regression"
+# Stored with each prediction so accuracy is tracked per version; bump when the model changes
+REGRESSION_VERSION = "linear_regression-v1"
+# Regression intervals are yhat +/- z * residual standard deviation (~80%, like Prophet's default)
+INTERVAL_Z = 1.2816
+
+
+def ensure_schema(conn):
+    for statement in SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _input_hash(df, *extra):
+    hashed = pd.util.hash_pandas_object(df, index=False)
+    digest = hashlib.sha1(hashed.values.tobytes())
+    digest.update(repr(extra).encode())
+    return digest.hexdigest()
+
+
+def _fit_prophet(task):
+    # Runs in a worker process; Prophet is only imported where it is needed
+    from prophet import Prophet
+    # cmdstanpy only installs its own INFO handler when the logger has none
+    logger = logging.getLogger("cmdstanpy")
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+    history, horizon, freq = task["history"], task["horizon"], task["freq"]
+    model = Prophet()
+    model.fit(history)
+    future = model.make_future_dataframe(periods=horizon, freq=freq)
+    forecast = model.predict(future)
+    last = history["ds"].max()
+    forecast["step"] = 0
+    is_future = forecast["ds"] > last
+    forecast.loc[is_future, "step"] = range(1, int(is_future.sum()) + 1)
+    return forecast[["ds", "step", "yhat", "yhat_lower", "yhat_upper"]]
+
+
+def _fit_regression(task):
+    # Notebook's univariate model: this quarter's residential prices -> next quarter's permits
+    from sklearn.linear_model import LinearRegression
+
+    train, live = task["train"], task["live"]
+    model = LinearRegression()
+    model.fit(train[["residential_prices"]], train["target"])
+    residuals = train["target"] - model.predict(train[["residential_prices"]])
+    spread = INTERVAL_Z * residuals.std(ddof=1)
+    yhat = float(model.predict(live[["residential_prices"]])[0])
+    return pd.DataFrame({
+        # Same quarter reconcile.py checks the prediction against
+        "ds": [next_quarter(live["datetime"].iloc[0])[1]],
+        "step": [1],
+        "yhat": [yhat],
+        "yhat_lower": [yhat - spread],
+        "yhat_upper": [yhat + spread],
+        "current_quarter": [live["datetime"].iloc[0]],
+        "residential_price": [float(live["residential_prices"].iloc[0])],
+    })
+
+
+def _prophet_tasks(store, country):
+    tasks = []
+    for frequency, horizon in HORIZONS.items():
+        catalog = store.catalog(country, frequency)
+        for series_id, indicator in zip(catalog["series_id"], catalog["indicator"]):
+            history = store.load([indicator], country, frequency).dropna()
+            history = history.rename(columns={"datetime": "ds", indicator: "y"})
+            if len(history) < 2:
+                continue
+            freq = PROPHET_FREQUENCIES[frequency]
+            tasks.append({
+                "series_id": int(series_id), "model": PROPHET, "label": f"{country} {indicator} ({frequency})",
+                "input_hash": _input_hash(history, horizon, freq),
+                "history": history, "horizon": horizon, "freq": freq,
+            })
+    return tasks
+
+
+def _regression_task(store, country):
+    catalog = store.catalog(country, "Q").set_index("indicator")
+    if "building_permits" not in catalog.index or "residential_prices" not in catalog.index:
+        return None
+    quarterly = store.load(None, country, "Q")
+    train = quarterly.dropna().copy()
+    train["target"] = train["building_permits"].shift(-1)
+    train = train.dropna()
+    live = quarterly.dropna(subset=["residential_prices"]).tail(1)
+    if len(train) < 2 or live.empty:
+        return None
+    return {
+        "series_id": int(catalog.at["building_permits", "series_id"]), "model": REGRESSION, "country": country,
+        "label": f"{country} building_permits (Q) from residential_prices",
+        "input_hash": _input_hash(pd.concat([train, live]), REGRESSION),
+        "train": train, "live": live,
+    }
+
+
+def _stale(conn, tasks):
+    runs = dict(((series_id, model), input_hash) for series_id, model, input_hash
+                in conn.execute("SELECT series_id, model, input_hash FROM forecast_runs"))
+    return [task for task in tasks if runs.get((task["series_id"], task["model"])) != task["input_hash"]]
+
+
+def _write(conn, task, forecast):
+    rows = [
+        (task["series_id"], task["model"], ds.strftime(DATE_FORMAT), int(step), yhat, lower, upper)
+        for ds, step, yhat, lower, upper in forecast[["ds", "step", "yhat", "yhat_lower", "yhat_upper"]].itertuples(index=False)
+    ]
+    with conn:
+        conn.execute("DELETE FROM forecasts WHERE series_id = ? AND model = ?", (task["series_id"], task["model"]))
+        conn.executemany("INSERT INTO forecasts (series_id, model, datetime, step, yhat, yhat_lower, yhat_upper) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        if task["model"] == REGRESSION and task["country"] == DEFAULT_COUNTRY:
+            # Keep the notebook's (German) prediction table current; a prediction already reconciled with its
+            # actual is final, since reconcile.py has folded it into the accuracy sums
+            conn.execute("""
+                INSERT INTO building_permit_predictions (current_quarter, residential_price, predicted_permits,
+                                                         model_version)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (current_quarter) DO UPDATE SET
+                    residential_price = excluded.residential_price,
+                    predicted_permits = excluded.predicted_permits,
+                    model_version = excluded.model_version
+                WHERE building_permit_predictions.actual_permits IS NULL
+            """, (forecast["current_quarter"].iloc[0].strftime(DATE_FORMAT),
+                  forecast["residential_price"].iloc[0], int(forecast["yhat"].iloc[0]), REGRESSION_VERSION))
+        conn.execute("INSERT OR REPLACE INTO forecast_runs (series_id, model, input_hash, fitted_at) VALUES (?, ?, ?, ?)",
+                     (task["series_id"], task["model"], task["input_hash"],
+                      datetime.now(timezone.utc).strftime(DATE_FORMAT)))
+
+
+def run(path=DB_PATH, country=None, workers=None, force=False):
+    # Every country in the store, or only `country`
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            series_store.ensure_schema(conn)
+            ensure_schema(conn)
+        store = SeriesStore(path)
+        tasks = []
+        for name in [country] if country is not None else store.countries():
+            tasks.extend(_prophet_tasks(store, name))
+            regression = _regression_task(store, name)
+            if regression is not None:
+                tasks.append(regression)
+        pending = tasks if force else _stale(conn, tasks)
+        fitted = []
+        if pending:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+                futures = {
+                    pool.submit(_fit_regression if task["model"] == REGRESSION else _fit_prophet, task): task
+                    for task in pending
+                }
+                for future in as_completed(futures):
+                    task = futures[future]
+                    _write(conn, task, future.result())
+                    fitted.append(task["label"])
+        return fitted, len(tasks) - len(pending)
+    finally:
+        conn.close()
+
+
+def load_forecast(indicator, country=DEFAULT_COUNTRY, frequency="M", model=PROPHET, periods=None, path=DB_PATH):
+    # Precomputed in-sample fit (step 0) plus the first `periods` steps ahead
+    sql = """
+        SELECT f.datetime AS ds, f.step, f.yhat, f.yhat_lower, f.yhat_upper
+        FROM forecasts f JOIN series s ON s.series_id = f.series_id
+        WHERE s.country = ? AND s.indicator = ? AND s.frequency = ? AND f.model = ?
+    """
+    params = [country, indicator, frequency, model]
+    if periods is not None:
+        sql += " AND f.step <= ?"
+        params.append(periods)
+    try:
+        df = db.read_sql(sql + " ORDER BY f.datetime", params, path=path)
+    except pd.errors.DatabaseError:
+        # Batch job has not created the table yet
+        return pd.DataFrame(columns=["ds", "step", "yhat", "yhat_lower", "yhat_upper"])
+    df["ds"] = pd.to_datetime(df["ds"])
+    return df
+
+
+def forecast_figure(history, forecast):
+    # Same layers as prophet.plot.plot_plotly: interval band, fitted line, actuals
+    fig = go.Figure([
+        go.Scatter(x=forecast["ds"], y=forecast["yhat_lower"], name="Lower", mode="lines",
+                   line=dict(width=0), hoverinfo="skip", showlegend=False),
+        go.Scatter(x=forecast["ds"], y=forecast["yhat_upper"], name="Upper", mode="lines",
+                   line=dict(width=0), fill="tonexty", fillcolor="rgba(0, 114, 178, 0.2)",
+                   hovertemplate="Date: %{x|%Y-%m-%d}<br>Upper: %{y:.2f}<extra></extra>", showlegend=False),
+        go.Scatter(x=forecast["ds"], y=forecast["yhat"], name="Forecast", mode="lines",
+                   line=dict(color="#0072B2", width=2),
+                   hovertemplate="Date: %{x|%Y-%m-%d}<br>Forecast: %{y:.2f}<extra></extra>"),
+        go.Scatter(x=history["ds"], y=history["y"], name="Actual", mode="markers",
+                   marker=dict(color="black", size=4),
+                   hovertemplate="Date: %{x|%Y-%m-%d}<br>Value: %{y:.2f}<extra></extra>"),
+    ])
+    fig.update_layout(hovermode="x unified", yaxis=dict(tickformat=".2f", fixedrange=False),
+                      xaxis_title="Date", showlegend=False, margin=dict(t=30))
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute forecasts for every series into the forecasts table")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--country", help="only forecast this country's series (default: every country)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="refit series whose input has not changed")
+    args = parser.parse_args()
+
+    fitted, skipped = run(args.db, args.country, args.workers, args.force)
+    for label in fitted:
+        print(f"Fitted {label}")
+    print(f"{len(fitted)} forecasts written, {skipped} unchanged series skipped")
+
+
+if __name__ == "__main__":
+    main()
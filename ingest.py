@@ -0,0 +1,328 @@
+import argparse
+import calendar
+import json
+import logging
+import sqlite3
+from datetime import date, datetime, timezone
+
+import anomalies
+import reconcile
+import series_store
+from db import DB_PATH
+
+# Incremental ingestion of TradingEconomics payloads (same shape as market_data_n8n.json).
+# Only new or revised points are written to the raw tables, and only the rows of the
+# derived market_data_* tables that depend on those points are recomputed.
+SERIES = {
+    "GERMANYBUIPER": {"table": "building_permits", "column": "building_permits", "monthly": True},
+    "GermanyConOut": {"table": "construction_output", "column": "construction_output", "monthly": True},
+    "BDPRR": {"table": "price_to_rent", "column": "price_to_rent_ratio", "monthly": False},
+    "BDRPP": {"table": "residential_prices", "column": "residential_prices", "monthly": False},
+}
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+logger = logging.getLogger(__name__)
+
+# Same window queries as the notebook, restricted to a start date so only the
+# rows feeding the affected outputs are scanned.
+QOQ_QUERY = """
+SELECT
+    STRFTIME('%Y', datetime) || 'Q' ||
+        ((CAST(STRFTIME('%m', datetime) AS INTEGER) - 1) / 3 + 1) AS quarter,
+    ROUND(building_permits, 2) AS current_permits,
+    ROUND(LAG(building_permits) OVER w, 2) AS previous_permits,
+    ROUND((building_permits - LAG(building_permits) OVER w) * 100.0 / LAG(building_permits) OVER w, 2) AS permits_qoq_pct,
+    ROUND(residential_prices, 2) AS current_prices,
+    ROUND(LAG(residential_prices) OVER w, 2) AS previous_prices,
+    ROUND((residential_prices - LAG(residential_prices) OVER w) * 100.0 / LAG(residential_prices) OVER w, 2) AS prices_qoq_pct,
+    ROUND(price_to_rent_ratio, 2) AS current_ratio,
+    ROUND(LAG(price_to_rent_ratio) OVER w, 2) AS previous_ratio,
+    ROUND((price_to_rent_ratio - LAG(price_to_rent_ratio) OVER w) * 100.0 / LAG(price_to_rent_ratio) OVER w, 2) AS ratio_qoq_pct,
+    ROUND(construction_output, 2) AS current_output,
+    ROUND(LAG(construction_output) OVER w, 2) AS previous_output,
+    ROUND((construction_output - LAG(construction_output) OVER w) * 100.0 / LAG(construction_output) OVER w, 2) AS output_qoq_pct
+FROM market_data_quarterly
+WHERE datetime >= ?
+WINDOW w AS (ORDER BY datetime)
+ORDER BY datetime
+"""
+
+YOY_QUERY = """
+WITH yearly AS (
+    SELECT
+        CAST(STRFTIME('%Y', datetime) AS INTEGER) AS year,
+        building_permits,
+        residential_prices,
+        price_to_rent_ratio,
+        construction_output
+    FROM market_data_yearly
+)
+SELECT
+    curr.year,
+    ROUND(curr.building_permits, 2) AS current_permits,
+    ROUND(prev.building_permits, 2) AS previous_permits,
+    ROUND((curr.building_permits - prev.building_permits) * 100.0 / prev.building_permits, 2) AS permits_yoy_pct,
+    ROUND(curr.residential_prices, 2) AS current_prices,
+    ROUND(prev.residential_prices, 2) AS previous_prices,
+    ROUND((curr.residential_prices - prev.residential_prices) * 100.0 / prev.residential_prices, 2) AS prices_yoy_pct,
+    ROUND(curr.price_to_rent_ratio, 2) AS current_ratio,
+    ROUND(prev.price_to_rent_ratio, 2) AS previous_ratio,
+    ROUND((curr.price_to_rent_ratio - prev.price_to_rent_ratio) * 100.0 / prev.price_to_rent_ratio, 2) AS ratio_yoy_pct,
+    ROUND(curr.construction_output, 2) AS current_output,
+    ROUND(prev.construction_output, 2) AS previous_output,
+    ROUND((curr.construction_output - prev.construction_output) * 100.0 / prev.construction_output, 2) AS output_yoy_pct
+FROM yearly curr
+JOIN yearly prev ON curr.year = prev.year + 1
+WHERE curr.year IN ({years})
+ORDER BY curr.year
+"""
+
+MOVING_AVG_QUERY = """
+SELECT
+    DATE(datetime) AS date,
+    ROUND(building_permits, 2) AS current_permits,
+    ROUND(AVG(building_permits) OVER (ORDER BY datetime ROWS 2 PRECEDING), 2) AS permits_3mo_avg,
+    ROUND(construction_output, 2) AS current_output,
+    ROUND(AVG(construction_output) OVER (ORDER BY datetime ROWS 2 PRECEDING), 2) AS output_3mo_avg
+FROM market_data_monthly
+WHERE datetime >= ?
+ORDER BY datetime
+"""
+
+def _placeholders(values):
+    return ",".join("?" * len(values))
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(str(value).replace("Z", "")).date()
+
+
+def _to_key(d):
+    return datetime(d.year, d.month, d.day).strftime(DATE_FORMAT)
+
+
+def _quarter_end(d):
+    month = ((d.month - 1) // 3 + 1) * 3
+    return date(d.year, month, calendar.monthrange(d.year, month)[1])
+
+
+def _quarter_label(d):
+    return f"{d.year}Q{(d.month - 1) // 3 + 1}"
+
+
+def _round(value):
+    # Same scale-and-round-half-even as the pandas .round(2) the notebook used;
+    # SQLite's ROUND rounds half away from zero and drifts by a cent on some means
+    return None if value is None else round(value * 100) / 100
+
+
+def _revised(old, new):
+    if old is None or new is None:
+        return old != new
+    return abs(old - new) > 1e-9
+
+
+def _rows_around(conn, table, column, keys, before, after):
+    # Earliest key to scan from (so window functions see `before` rows of history),
+    # plus each key together with the `after` rows that follow it
+    start = min(keys)
+    history = conn.execute(
+        f"SELECT {column} FROM {table} WHERE {column} < ? ORDER BY {column} DESC LIMIT ?", (start, before)
+    ).fetchall()
+    if history:
+        start = history[-1][0]
+    affected = set(keys)
+    if after:
+        for key in keys:
+            following = conn.execute(
+                f"SELECT {column} FROM {table} WHERE {column} > ? ORDER BY {column} LIMIT ?", (key, after)
+            ).fetchall()
+            affected.update(row[0] for row in following)
+    return start, sorted(affected)
+
+
+def upsert_series(conn, spec, points, lastupdate, metadata):
+    table = spec["table"]
+    existing = dict(conn.execute(f"SELECT datetime, value FROM {table} WHERE datetime IS NOT NULL"))
+    inserts, updates = [], []
+    for key, value in points.items():
+        if key not in existing:
+            inserts.append((key, metadata.get("Country"), metadata.get("Category"), value,
+                            metadata.get("Frequency"), metadata.get("HistoricalDataSymbol"), lastupdate))
+        elif _revised(existing[key], value):
+            updates.append((value, lastupdate, key))
+    conn.executemany(
+        f"INSERT INTO {table} (datetime, country, category, value, frequency, historicaldatasymbol, lastupdate) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", inserts)
+    conn.executemany(f"UPDATE {table} SET value = ?, lastupdate = ? WHERE datetime = ?", updates)
+    return sorted([row[0] for row in inserts] + [row[2] for row in updates])
+
+
+def refresh_monthly(conn, months):
+    conn.execute(f"DELETE FROM market_data_monthly WHERE datetime IN ({_placeholders(months)})", months)
+    rows = []
+    for key in months:
+        bp = conn.execute("SELECT value FROM building_permits WHERE datetime = ?", (key,)).fetchone()
+        co = conn.execute("SELECT value FROM construction_output WHERE datetime = ?", (key,)).fetchone()
+        if bp or co:
+            rows.append((key, bp[0] if bp else None, co[0] if co else None, _quarter_label(_parse_date(key))))
+    conn.executemany(
+        "INSERT INTO market_data_monthly (datetime, building_permits, construction_output, quarter) VALUES (?, ?, ?, ?)",
+        rows)
+
+
+def refresh_quarterly(conn, keys):
+    # Monthly series are averaged into their quarter end; quarterly series keep their own dates
+    conn.execute(f"DELETE FROM market_data_quarterly WHERE datetime IN ({_placeholders(keys)})", keys)
+    rows = []
+    for key in keys:
+        d = _parse_date(key)
+        values = {}
+        for spec in SERIES.values():
+            if spec["monthly"]:
+                if d != _quarter_end(d):
+                    values[spec["column"]] = None
+                    continue
+                month_start = _to_key(date(d.year, d.month - 2, 1))
+                values[spec["column"]] = _round(conn.execute(
+                    f"SELECT AVG(value) FROM {spec['table']} WHERE datetime >= ? AND datetime <= ?",
+                    (month_start, key)).fetchone()[0])
+            else:
+                row = conn.execute(f"SELECT value FROM {spec['table']} WHERE datetime = ?", (key,)).fetchone()
+                values[spec["column"]] = row[0] if row else None
+        if any(value is not None for value in values.values()):
+            rows.append((key, values["building_permits"], values["price_to_rent_ratio"],
+                         values["construction_output"], values["residential_prices"], _quarter_label(d)))
+    conn.executemany(
+        "INSERT INTO market_data_quarterly (datetime, building_permits, price_to_rent_ratio, construction_output, "
+        "residential_prices, quarter) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def refresh_yearly(conn, years):
+    keys = [_to_key(date(year, 12, 31)) for year in years]
+    conn.execute(f"DELETE FROM market_data_yearly WHERE datetime IN ({_placeholders(keys)})", keys)
+    rows = []
+    for year, key in zip(years, keys):
+        count, *means = conn.execute("""
+            SELECT COUNT(*), AVG(building_permits), AVG(price_to_rent_ratio),
+                   AVG(construction_output), AVG(residential_prices)
+            FROM market_data_quarterly
+            WHERE datetime >= ? AND datetime <= ?
+        """, (_to_key(date(year, 1, 1)), key)).fetchone()
+        if count:
+            rows.append((key, *[_round(mean) for mean in means], year))
+    conn.executemany(
+        "INSERT INTO market_data_yearly (datetime, building_permits, price_to_rent_ratio, construction_output, "
+        "residential_prices, year) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def refresh_qoq(conn, keys):
+    start, affected = _rows_around(conn, "market_data_quarterly", "datetime", keys, before=1, after=1)
+    labels = sorted({_quarter_label(_parse_date(key)) for key in affected})
+    conn.execute(f"DELETE FROM market_data_qoq WHERE quarter IN ({_placeholders(labels)})", labels)
+    rows = [row for row in conn.execute(QOQ_QUERY, (start,)) if row[0] in labels]
+    if rows:
+        conn.executemany(f"INSERT INTO market_data_qoq VALUES ({_placeholders(rows[0])})", rows)
+
+
+def refresh_yoy(conn, years):
+    affected = sorted(set(years) | {year + 1 for year in years})
+    conn.execute(f"DELETE FROM market_data_yoy WHERE year IN ({_placeholders(affected)})", affected)
+    rows = conn.execute(YOY_QUERY.format(years=_placeholders(affected)), affected).fetchall()
+    if rows:
+        conn.executemany(f"INSERT INTO market_data_yoy VALUES ({_placeholders(rows[0])})", rows)
+
+
+def refresh_moving_average(conn, months):
+    start, affected = _rows_around(conn, "market_data_monthly", "datetime", months, before=2, after=2)
+    dates = [key[:10] for key in affected]
+    conn.execute(f"DELETE FROM market_data_m_avg WHERE date IN ({_placeholders(dates)})", dates)
+    rows = [row for row in conn.execute(MOVING_AVG_QUERY, (start,)) if row[0] in dates]
+    if rows:
+        conn.executemany(f"INSERT INTO market_data_m_avg VALUES ({_placeholders(rows[0])})", rows)
+
+
+def _score_new_points(conn, frequency, keys):
+    indicators = series_store.LEGACY_TABLES[frequency][1]
+    ids = series_store.ensure_series(conn, series_store.DEFAULT_COUNTRY, frequency, indicators)
+    anomalies.update(conn, list(ids.values()), since=min(keys))
+
+
+def ingest(payload, path=DB_PATH):
+    now = datetime.now(timezone.utc).strftime(DATE_FORMAT)
+    summary = {}
+    months, quarter_keys = set(), set()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for symbol, series in payload.items():
+            spec = SERIES.get(symbol)
+            if spec is None:
+                logger.warning("Skipping unknown symbol '%s'", symbol)
+                continue
+            metadata = series.get("metadata", {})
+            points = {_to_key(_parse_date(p["DateTime"])): p["Value"] for p in series.get("data", [])}
+            lastupdate = metadata.get("LastUpdate", now)
+            changed = upsert_series(conn, spec, points, lastupdate, metadata)
+            summary[spec["table"]] = len(changed)
+            for key in changed:
+                d = _parse_date(key)
+                if spec["monthly"]:
+                    months.add(key)
+                    quarter_keys.add(_to_key(_quarter_end(d)))
+                else:
+                    quarter_keys.add(key)
+
+        series_store.ensure_schema(conn)
+        if months:
+            months = sorted(months)
+            refresh_monthly(conn, months)
+            series_store.sync_from_legacy(conn, "M", months)
+            refresh_moving_average(conn, months)
+            # Only new points are scored; a revision of the latest points rolls back one step
+            _score_new_points(conn, "M", months)
+        if quarter_keys:
+            quarter_keys = sorted(quarter_keys)
+            years = sorted({_parse_date(key).year for key in quarter_keys})
+            refresh_quarterly(conn, quarter_keys)
+            series_store.sync_from_legacy(conn, "Q", quarter_keys)
+            refresh_qoq(conn, quarter_keys)
+            _score_new_points(conn, "Q", quarter_keys)
+            # New quarterly permits may be the actuals of earlier predictions
+            reconcile.update(conn)
+            refresh_yearly(conn, years)
+            year_keys = [_to_key(date(year, 12, 31)) for year in years]
+            series_store.sync_from_legacy(conn, "Y", year_keys)
+            refresh_yoy(conn, years)
+            _score_new_points(conn, "Y", year_keys)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upsert a TradingEconomics payload into market_data.db")
+    parser.add_argument("payload", help="JSON file shaped like market_data_n8n.json")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--snapshot", action="store_true", help="pre-render dashboard1 for the new data version")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with open(args.payload) as f:
+        payload = json.load(f)
+    summary = ingest(payload, args.db)
+    for table, count in summary.items():
+        print(f"Upserted {count} points into '{table}'")
+    if args.snapshot:
+        # Imported here so plain ingestion does not load the plotting stack
+        import snapshot
+        directory, _ = snapshot.build(args.db)
+        print(f"Snapshot: {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+# Period-over-period KPIs for any number of series in one vectorized pass.
+# Long input has one row per (indicator, datetime, value); wide input has a
+# datetime column plus one column per indicator. Missing values are gaps:
+# each point is compared with the previous *observed* point of its series.
+PERIOD_FORMATS = {"M": "%Y-%m", "Q": "%YQ%q", "Y": "%Y"}
+
+
+def period_labels(datetimes, freq="Q", fmt=None):
+    labels = pd.PeriodIndex(pd.to_datetime(datetimes), freq=freq).strftime(fmt or PERIOD_FORMATS[freq])
+    return pd.Series(labels, index=getattr(datetimes, "index", None))
+
+
+def next_quarter(value):
+    # (first day, last day) of the calendar quarter after the one containing `value`:
+    # a prediction made on 2024-10-30 or 2024-12-31 is for Q1 2025
+    period = pd.Period(pd.Timestamp(value), freq="Q") + 1
+    return period.start_time, period.end_time.normalize()
+
+
+def pct_change(current, previous):
+    current = np.asarray(current, dtype=float)
+    previous = np.asarray(previous, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = (current - previous) / previous * 100
+    change[~np.isfinite(change)] = np.nan
+    return np.round(change, 2)
+
+
+def latest_vs_previous(long, freq="Q"):
+    # One row per indicator (in input order): latest and previous observed values,
+    # their period labels and the percent change between them
+    order = pd.unique(long["indicator"])
+    observed = long.dropna(subset=["value"]).sort_values(["indicator", "datetime"], ascending=[True, False])
+    rank = observed.groupby("indicator", sort=False).cumcount().to_numpy()
+    latest = observed[rank == 0].set_index("indicator").reindex(order)
+    previous = observed[rank == 1].set_index("indicator").reindex(order)
+
+    result = pd.DataFrame({
+        "indicator": order,
+        "latest_date": latest["datetime"].to_numpy(),
+        "latest": latest["value"].to_numpy(dtype=float),
+        "previous_date": previous["datetime"].to_numpy(),
+        "previous": previous["value"].to_numpy(dtype=float),
+    })
+    result["change_pct"] = pct_change(result["latest"], result["previous"])
+    has_change = result["change_pct"].notna()
+    result["latest_label"] = None
+    result["previous_label"] = None
+    result["comparison"] = "N/A"
+    if has_change.any():
+        latest_labels = period_labels(result.loc[has_change, "latest_date"], freq)
+        previous_labels = period_labels(result.loc[has_change, "previous_date"], freq)
+        result.loc[has_change, "latest_label"] = latest_labels
+        result.loc[has_change, "previous_label"] = previous_labels
+        result.loc[has_change, "comparison"] = latest_labels + " vs " + previous_labels
+    return result
+
+
+def period_change(wide, periods=1):
+    # Percent change of every column at once. With periods=1 each point is compared with
+    # the previous observed point of its column; larger periods shift by rows, so they
+    # expect a regular grid (e.g. 12 for YoY on monthly data)
+    values = wide.drop(columns="datetime")
+    if periods == 1:
+        previous = values.ffill().shift(1)
+    else:
+        previous = values.shift(periods)
+    change = pct_change(values.to_numpy(dtype=float), previous.to_numpy(dtype=float))
+    result = pd.DataFrame(change, index=values.index, columns=values.columns)
+    result.insert(0, "datetime", wide["datetime"])
+    return result
+
+
+def rolling_mean(wide, window=3):
+    # Trailing mean over the last `window` rows, ignoring gaps like SQL's AVG ... ROWS n PRECEDING
+    values = wide.drop(columns="datetime")
+    result = values.rolling(window, min_periods=1).mean().round(2)
+    result.insert(0, "datetime", wide["datetime"])
+    return result
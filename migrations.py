@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from db import DB_PATH
+
+# Versioned schema migrations for market_data.db, tracked with PRAGMA user_version.
+# The notebook writes every table through pandas.to_sql, which leaves them without
+# keys or indexes and with TIMESTAMP (numeric affinity) date columns.
+RAW_TABLES = ["building_permits", "price_to_rent", "construction_output", "residential_prices"]
+PER_INDICATOR_TABLES = [f"{name}_{freq}" for name in RAW_TABLES for freq in ("quarterly", "yearly")]
+
+PRIMARY_KEYS = {
+    **{table: "datetime" for table in RAW_TABLES + PER_INDICATOR_TABLES},
+    "market_data_wide": "datetime",
+    "market_data_monthly": "datetime",
+    "market_data_quarterly": "datetime",
+    "market_data_yearly": "datetime",
+    "market_data_yoy": "year",
+    "market_data_m_avg": "date",
+    "market_data_anom": "date",
+    "building_permit_predictions": "current_quarter",
+}
+
+# Quarter labels in market_data_qoq are not unique once a quarterly series has an
+# off-calendar date, so that table only gets a plain index
+INDEXES = {
+    **{table: [("historicaldatasymbol", "datetime")] for table in RAW_TABLES + PER_INDICATOR_TABLES},
+    "market_data_qoq": [("quarter",)],
+}
+
+# Reads of the notebook's market_data_* tables, which migrations 1 and 2 target, timed by
+# --benchmark. The dashboards themselves read series_values since the series store
+# (benchmark.py times those paths).
+LEGACY_QUERIES = {
+    "qoq_cards": "SELECT * FROM market_data_quarterly ORDER BY datetime DESC",
+    "monthly_latest_two": "SELECT * FROM market_data_monthly ORDER BY datetime DESC LIMIT 2",
+    "scatter_quarterly": "SELECT * FROM market_data_quarterly ORDER BY datetime",
+    "scatter_yearly": "SELECT * FROM market_data_yearly ORDER BY datetime",
+    "latest_prediction": "SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1",
+    "prophet_input": "SELECT datetime, building_permits FROM market_data_monthly "
+                     "WHERE building_permits IS NOT NULL ORDER BY datetime",
+    "yoy": "SELECT * FROM market_data_yoy ORDER BY year",
+    "moving_average": "SELECT * FROM market_data_m_avg ORDER BY date",
+}
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _columns(conn, table):
+    return [(row[1], row[2].upper()) for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def _normalized(name, declared):
+    # TIMESTAMP text becomes ISO text with TEXT affinity, so comparisons against
+    # partial dates ('2020-01') stay string comparisons
+    if declared == "TIMESTAMP":
+        return "TEXT", f"strftime('%Y-%m-%d %H:%M:%S', \"{name}\")"
+    if name == "date":
+        return "TEXT", f"date(\"{name}\")"
+    return declared, f'"{name}"'
+
+
+def add_primary_keys(conn):
+    existing = _tables(conn)
+    for table, key in PRIMARY_KEYS.items():
+        if table not in existing:
+            continue
+        columns = _columns(conn, table)
+        definitions, expressions = [], []
+        for name, declared in columns:
+            column_type, expression = _normalized(name, declared)
+            definitions.append(f'"{name}" {column_type}')
+            expressions.append(expression)
+        # WITHOUT ROWID clusters rows on the key, so ORDER BY key reads are a sequential scan
+        conn.execute(f'CREATE TABLE "{table}__new" ({", ".join(definitions)}, PRIMARY KEY ("{key}")) WITHOUT ROWID')
+        # Rows without a key are empty 'NaT' artefacts of the notebook's outer merges
+        conn.execute(f'INSERT OR REPLACE INTO "{table}__new" SELECT {", ".join(expressions)} '
+                     f'FROM "{table}" WHERE "{key}" IS NOT NULL ORDER BY rowid')
+        conn.execute(f'DROP TABLE "{table}"')
+        conn.execute(f'ALTER TABLE "{table}__new" RENAME TO "{table}"')
+
+
+def add_indexes(conn):
+    existing = _tables(conn)
+    for table, indexes in INDEXES.items():
+        if table not in existing:
+            continue
+        for columns in indexes:
+            name = f"idx_{table}_{'_'.join(columns)}"
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({", ".join(columns)})')
+
+
+def add_model_versions(conn):
+    # Accuracy is tracked per model version; rows written before versioning came from the notebook
+    if "building_permit_predictions" in _tables(conn) and "model_version" not in dict(
+            _columns(conn, "building_permit_predictions")):
+        conn.execute("ALTER TABLE building_permit_predictions "
+                     "ADD COLUMN model_version TEXT NOT NULL DEFAULT 'notebook'")
+
+
+MIGRATIONS = [
+    (1, "primary keys and ISO text dates", add_primary_keys),
+    (2, "series and quarter indexes", add_indexes),
+    (3, "prediction model versions", add_model_versions),
+]
+
+
+def migrate(path=DB_PATH):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for target, description, step in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            print(f"Applied migration {target}: {description}")
+        # Readers no longer block the ingestion writer, and the planner gets fresh statistics
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("ANALYZE")
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Date columns by name, since migration 1 turns their TIMESTAMP declarations into TEXT
+DATE_COLUMNS = {"datetime", "current_quarter"}
+
+
+def _shift(name, declared, years):
+    if declared == "TIMESTAMP" or name in DATE_COLUMNS:
+        return f"datetime(\"{name}\", printf('-%d years', {years}))"
+    if name == "date":
+        return f"date(\"{name}\", printf('-%d years', {years}))"
+    if name == "year":
+        return f'"{name}" - {years}'
+    if name == "quarter":
+        return (f"CASE WHEN \"{name}\" GLOB '[0-9][0-9][0-9][0-9]Q*' "
+                f"THEN (CAST(substr(\"{name}\", 1, 4) AS INTEGER) - {years}) || substr(\"{name}\", 5) "
+                f"ELSE \"{name}\" END")
+    return f'"{name}"'
+
+
+def scale_up(src, dst, copies):
+    # Copy the database and append `copies` replicas of every dated table, each shifted back
+    # by a multiple of 8 years so leap days and month ends keep lining up
+    shutil.copy(src, dst)
+    conn = sqlite3.connect(dst)
+    for table in _tables(conn):
+        columns = _columns(conn, table)
+        shifted = [_shift(name, declared, "8 * k.n") for name, declared in columns]
+        if shifted == [f'"{name}"' for name, _ in columns]:
+            # Nothing dated to shift (series, accuracy and state tables): replicas would collide
+            continue
+        expressions = ", ".join(shifted)
+        conn.execute(f"""
+            WITH RECURSIVE k(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM k WHERE n < ?)
+            INSERT INTO "{table}" SELECT {expressions} FROM "{table}", k
+        """, (copies,))
+    conn.commit()
+    conn.close()
+
+
+def time_queries(path, repeat):
+    conn = sqlite3.connect(path)
+    timings = {}
+    for name, sql in LEGACY_QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = conn.execute(sql).fetchall()
+            samples.append(time.perf_counter() - start)
+        timings[name] = {"rows": len(rows), "median_ms": round(statistics.median(samples) * 1000, 3)}
+    conn.close()
+    return timings
+
+
+def benchmark(src, copies, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "market_data_scaled.db")
+        scale_up(src, path, copies)
+        before = time_queries(path, repeat)
+        migrate(path)
+        after = time_queries(path, repeat)
+    return {
+        name: {
+            "rows": after[name]["rows"],
+            "before_ms": before[name]["median_ms"],
+            "after_ms": after[name]["median_ms"],
+            "speedup": round(before[name]["median_ms"] / max(after[name]["median_ms"], 1e-6), 1),
+        }
+        for name in LEGACY_QUERIES
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations to market_data.db")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--benchmark", action="store_true",
+                        help="time the legacy table queries on a scaled-up copy before and after migrating "
+                             "(an already migrated --db shows no speedup)")
+    parser.add_argument("--scale", type=int, default=200, help="number of shifted replicas for --benchmark (max 250)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.db, min(args.scale, 250), args.repeat), indent=2))
+    else:
+        version = migrate(args.db)
+        print(f"'{args.db}' is at schema version {version}")
+
+
+if __name__ == "__main__":
+    main()
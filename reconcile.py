@@ -0,0 +1,170 @@
+import argparse
+import sqlite3
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import db
+import migrations
+from db import DB_PATH
+from kpi import next_quarter
+
+# Reconciliation of building_permit_predictions with the quarterly actuals, and running
+# accuracy per model version. One set-based UPDATE fills every prediction whose next
+# quarter now has a building permits value; the rows it fills are folded into
+# per-version error sums (MAE, MAPE, bias), and the rolling figures are recomputed from
+# only the last ROLLING_WINDOW reconciled quarters, so nothing rescans the history.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prediction_accuracy (
+    model_version TEXT PRIMARY KEY,
+    predictions INTEGER NOT NULL,
+    abs_error_sum REAL NOT NULL,
+    pct_predictions INTEGER NOT NULL,
+    abs_pct_error_sum REAL NOT NULL,
+    error_sum REAL NOT NULL,
+    rolling_mae REAL,
+    rolling_mape REAL,
+    rolling_bias REAL,
+    last_quarter TEXT,
+    updated_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_building_permit_predictions_model_version
+    ON building_permit_predictions (model_version, current_quarter);
+"""
+
+ROLLING_WINDOW = 4
+
+# The actual for a prediction is the first building permits value in the calendar quarter
+# after the one containing current_quarter (kpi.next_quarter, which forecasts.py also dates
+# the regression's forecast with). Truncated to an integer like the notebook's
+# update_actual_permits_from_market_data(). That value averages the quarter's months, so
+# it is only final once all three are in.
+BACKFILL = """
+WITH actuals AS (
+    SELECT p.current_quarter, q.building_permits,
+           ROW_NUMBER() OVER (PARTITION BY p.current_quarter ORDER BY q.datetime) AS position
+    FROM building_permit_predictions p
+    JOIN market_data_quarterly q
+      ON q.datetime >= next_quarter_start(p.current_quarter) AND q.datetime <= next_quarter_end(p.current_quarter)
+    WHERE p.actual_permits IS NULL AND q.building_permits IS NOT NULL
+      AND (SELECT COUNT(m.building_permits) FROM market_data_monthly m
+           WHERE m.datetime >= next_quarter_start(p.current_quarter)
+             AND m.datetime <= next_quarter_end(p.current_quarter)) = 3
+)
+UPDATE building_permit_predictions
+SET actual_permits = CAST(actuals.building_permits AS INTEGER)
+FROM actuals
+WHERE building_permit_predictions.current_quarter = actuals.current_quarter AND actuals.position = 1
+RETURNING model_version, building_permit_predictions.current_quarter, predicted_permits, actual_permits
+"""
+
+
+def _register_functions(conn):
+    for name, index in (("next_quarter_start", 0), ("next_quarter_end", 1)):
+        conn.create_function(name, 1, lambda value, index=index: next_quarter(value)[index].strftime("%Y-%m-%d %H:%M:%S"),
+                             deterministic=True)
+
+
+def ensure_schema(conn):
+    for statement in SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _fold(sums, version, quarter, predicted, actual):
+    error = predicted - actual
+    totals = sums.setdefault(version, [0, 0.0, 0, 0.0, 0.0, None])
+    totals[0] += 1
+    totals[1] += abs(error)
+    if actual:
+        # An actual of zero has no percentage error
+        totals[2] += 1
+        totals[3] += abs(error) / abs(actual) * 100
+    totals[4] += error
+    totals[5] = max(totals[5] or quarter, quarter)
+
+
+def _rolling(conn, version):
+    rows = conn.execute("""
+        SELECT predicted_permits, actual_permits FROM building_permit_predictions
+        WHERE model_version = ? AND actual_permits IS NOT NULL
+        ORDER BY current_quarter DESC LIMIT ?
+    """, (version, ROLLING_WINDOW)).fetchall()
+    errors = [predicted - actual for predicted, actual in rows]
+    pct = [abs(predicted - actual) / abs(actual) * 100 for predicted, actual in rows if actual]
+    return (sum(abs(e) for e in errors) / len(errors), sum(pct) / len(pct) if pct else None,
+            sum(errors) / len(errors))
+
+
+def update(conn, rebuild=False):
+    # Backfills actuals and folds the newly reconciled predictions into the accuracy table
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "building_permit_predictions" not in tables:
+        return 0
+    # Databases ingest.py reaches before migration 3 get the model_version column here
+    migrations.add_model_versions(conn)
+    created = "prediction_accuracy" not in tables
+    ensure_schema(conn)
+    _register_functions(conn)
+    filled = conn.execute(BACKFILL).fetchall()
+    sums = {}
+    if rebuild or created:
+        conn.execute("DELETE FROM prediction_accuracy")
+        reconciled = conn.execute("SELECT model_version, current_quarter, predicted_permits, actual_permits "
+                                  "FROM building_permit_predictions WHERE actual_permits IS NOT NULL").fetchall()
+    else:
+        reconciled = filled
+        for version, *totals in conn.execute(
+                "SELECT model_version, predictions, abs_error_sum, pct_predictions, abs_pct_error_sum, error_sum, "
+                "last_quarter FROM prediction_accuracy"):
+            sums[version] = totals
+    changed = set()
+    for version, quarter, predicted, actual in reconciled:
+        if predicted is not None:
+            _fold(sums, version, quarter, predicted, actual)
+            changed.add(version)
+    updated_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    for version in changed:
+        conn.execute("INSERT OR REPLACE INTO prediction_accuracy VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (version, *sums[version][:5], *_rolling(conn, version), sums[version][5], updated_at))
+    return len(filled)
+
+
+def accuracy(path=DB_PATH):
+    # MAE, MAPE and bias (mean of predicted - actual) per model version, all-time and rolling
+    try:
+        df = db.read_sql("SELECT * FROM prediction_accuracy ORDER BY model_version", path=path)
+    except pd.errors.DatabaseError:
+        # reconcile.py has not run against this database yet
+        return pd.DataFrame(columns=["model_version", "predictions", "mae", "mape", "bias", "rolling_mae",
+                                     "rolling_mape", "rolling_bias", "last_quarter"])
+    df["mae"] = df["abs_error_sum"] / df["predictions"]
+    df["mape"] = df["abs_pct_error_sum"] / df["pct_predictions"].where(df["pct_predictions"] > 0)
+    df["bias"] = df["error_sum"] / df["predictions"]
+    return df[["model_version", "predictions", "mae", "mape", "bias", "rolling_mae", "rolling_mape", "rolling_bias",
+               "last_quarter"]]
+
+
+def run(path=DB_PATH, rebuild=False):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            return update(conn, rebuild)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill actual permits into building_permit_predictions "
+                                                 "and update the accuracy summary")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="recompute the accuracy summary from all predictions")
+    args = parser.parse_args()
+
+    filled = run(args.db, args.rebuild)
+    print(f"Reconciled {filled} predictions")
+    print(accuracy(args.db).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import pandas as pd
+import plotly.express as px
+
+import db
+from charts import downsample
+from db import DB_PATH
+from forecasts import forecast_figure
+from kpi import latest_vs_previous, period_change, rolling_mean
+
+# Data and figures behind dashboard1's sections, shared by the page and snapshot.py,
+# so a pre-rendered snapshot holds exactly what the page would have built.
+FORECAST_PERIODS = range(1, 13)
+# Column stems of the baseline market_data_yoy table (current_permits, permits_yoy_pct, ...),
+# kept for its indicators, in its order, so existing CSV consumers see the same headers
+YOY_STEMS = {
+    "building_permits": "permits",
+    "residential_prices": "prices",
+    "price_to_rent_ratio": "ratio",
+    "construction_output": "output",
+}
+
+
+def title(indicator):
+    return indicator.replace('_', ' ').title()
+
+
+def qoq_cards(store, country):
+    # One row per quarterly indicator, in catalog order, with its display name
+    catalog = store.catalog(country, "Q")
+    # Only the last two observed quarters of each series, newest first
+    df_kpi = latest_vs_previous(store.latest(list(catalog["indicator"]), country, "Q", n=2), "Q")
+    df_kpi.insert(0, "name", df_kpi["indicator"].map(dict(zip(catalog["indicator"], catalog["name"]))))
+    return df_kpi
+
+
+def latest_prediction(path=DB_PATH):
+    return db.read_sql("SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1", path=path)
+
+
+def scatter_figure(df, kpi):
+    fig = px.scatter(downsample(df, "datetime", [kpi]), x="datetime", y=kpi, title=f"{title(kpi)} Over Time",
+                     labels={"datetime": "Date", kpi: title(kpi)}, color_discrete_sequence=["#008080"])
+    fig.update_traces(mode='lines+markers', hovertemplate='Date: %{x|%Y-%m-%d}<br>Value: %{y:.2f}<extra></extra>')
+    fig.update_layout(hovermode="x unified", yaxis=dict(tickformat=".2f", fixedrange=False))
+    return fig
+
+
+def prophet_history(store, country):
+    return store.load(["building_permits"], country, "M").rename(columns={"datetime": "ds", "building_permits": "y"})
+
+
+def prophet_figure(history, forecast):
+    return forecast_figure(downsample(history, "ds", ["y"]),
+                           downsample(forecast, "ds", ["yhat", "yhat_lower", "yhat_upper"]))
+
+
+def yoy_tables(store, country):
+    # (wide table with each yearly indicator's level, previous level and YoY %, long table
+    # of the YoY % for the grouped bar chart), first year dropped; other indicators of the
+    # catalog follow the baseline ones as current_<indicator>, <indicator>_yoy_pct, ...
+    catalog = store.catalog(country, "Y")
+    names = dict(zip(catalog["indicator"], catalog["name"]))
+    df_yearly = store.load(list(names), country, "Y")
+    indicators = [indicator for indicator in [*YOY_STEMS, *names] if indicator in names and indicator in df_yearly]
+    indicators = list(dict.fromkeys(indicators))
+    values = df_yearly[indicators]
+    # Same previous observed point that period_change compares with
+    previous = values.ffill().shift(1)
+    change = period_change(df_yearly)
+    df_yoy = pd.DataFrame({"year": df_yearly["datetime"].dt.year})
+    stems = {indicator: YOY_STEMS.get(indicator, indicator) for indicator in indicators}
+    for indicator, stem in stems.items():
+        df_yoy[f"current_{stem}"] = values[indicator].round(2)
+        df_yoy[f"previous_{stem}"] = previous[indicator].round(2)
+        df_yoy[f"{stem}_yoy_pct"] = change[indicator]
+    df_yoy = df_yoy.iloc[1:].reset_index(drop=True)
+    df_yoy_melt = df_yoy.melt(id_vars="year", value_vars=[f"{stem}_yoy_pct" for stem in stems.values()],
+                              var_name="Metric", value_name="YoY Growth (%)")
+    df_yoy_melt["Metric"] = df_yoy_melt["Metric"].map({f"{stem}_yoy_pct": names[indicator] for indicator, stem in stems.items()})
+    return df_yoy, df_yoy_melt
+
+
+def yoy_figure(df_yoy_melt):
+    fig_yoy = px.bar(df_yoy_melt, x="year", y="YoY Growth (%)", color="Metric", barmode="group", text="YoY Growth (%)", color_discrete_sequence=px.colors.qualitative.Set2)
+    fig_yoy.update_traces(textposition="outside")
+    fig_yoy.update_layout(yaxis_tickformat=".2f", xaxis_title="Year", yaxis_title="% Change")
+    return fig_yoy
+
+
+def moving_average_table(store, country):
+    df_output = store.load(["construction_output"], country, "M")
+    return pd.DataFrame({
+        "date": df_output["datetime"],
+        "current_output": df_output["construction_output"].round(2),
+        "output_3mo_avg": rolling_mean(df_output, window=3)["construction_output"]
+    })
+
+
+def moving_average_figure(df_ma):
+    fig_ma = px.line(downsample(df_ma, "date", ["current_output", "output_3mo_avg"]), x="date", y=["current_output", "output_3mo_avg"], labels={"value": "Construction Output", "date": "Date"},
+                     title="Construction Output vs 3-Month Moving Average", color_discrete_map={"current_output": "#1f77b4", "output_3mo_avg": "#ff7f0e"})
+    fig_ma.update_layout(legend_title_text="Legend")
+    return fig_ma
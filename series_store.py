@@ -0,0 +1,204 @@
+import argparse
+import sqlite3
+
+import pandas as pd
+
+import db
+from db import DB_PATH
+
+# Long-format series store: one catalog row per (country, indicator, frequency) and one
+# value row per (series, datetime), clustered on that key. Any subset of series and
+# dates can be read lazily and pivoted to the wide layout the dashboards plot.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    series_id INTEGER PRIMARY KEY,
+    symbol TEXT,
+    country TEXT NOT NULL,
+    indicator TEXT NOT NULL,
+    name TEXT,
+    frequency TEXT NOT NULL,
+    UNIQUE (country, indicator, frequency)
+);
+CREATE TABLE IF NOT EXISTS series_values (
+    series_id INTEGER NOT NULL REFERENCES series (series_id),
+    datetime TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series_id, datetime)
+) WITHOUT ROWID;
+"""
+
+# Symbol and display name of the indicators held in the legacy market_data_* tables
+INDICATORS = {
+    "building_permits": ("GERMANYBUIPER", "Building Permits"),
+    "construction_output": ("GermanyConOut", "Construction Output"),
+    "price_to_rent_ratio": ("BDPRR", "Price-to-Rent Ratio"),
+    "residential_prices": ("BDRPP", "Residential Prices"),
+}
+LEGACY_TABLES = {
+    "M": ("market_data_monthly", ["building_permits", "construction_output"]),
+    "Q": ("market_data_quarterly", list(INDICATORS)),
+    "Y": ("market_data_yearly", list(INDICATORS)),
+}
+FREQUENCIES = {"Monthly": "M", "Quarterly": "Q", "Yearly": "Y"}
+DEFAULT_COUNTRY = "Germany"
+MAX_COMPOUND_SELECTS = 200
+
+
+def _placeholders(values):
+    return ",".join("?" * len(values))
+
+
+def ensure_schema(conn):
+    # Statement by statement: executescript would commit the caller's open transaction
+    for statement in SCHEMA.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def ensure_series(conn, country, frequency, indicators):
+    ids = {}
+    for indicator in indicators:
+        symbol, name = INDICATORS.get(indicator, (None, indicator.replace("_", " ").title()))
+        conn.execute(
+            "INSERT OR IGNORE INTO series (symbol, country, indicator, name, frequency) VALUES (?, ?, ?, ?, ?)",
+            (symbol, country, indicator, name, frequency))
+        ids[indicator] = conn.execute(
+            "SELECT series_id FROM series WHERE country = ? AND indicator = ? AND frequency = ?",
+            (country, indicator, frequency)).fetchone()[0]
+    return ids
+
+
+def sync_from_legacy(conn, frequency, keys=None, country=DEFAULT_COUNTRY):
+    # Mirror rows of a wide market_data_* table into the store; keys=None copies the whole table
+    table, indicators = LEGACY_TABLES[frequency]
+    ids = ensure_series(conn, country, frequency, indicators)
+    series_ids = list(ids.values())
+    if keys is None:
+        conn.execute(f"DELETE FROM series_values WHERE series_id IN ({_placeholders(series_ids)})", series_ids)
+        rows = conn.execute(f"SELECT datetime, {', '.join(indicators)} FROM {table} WHERE datetime IS NOT NULL")
+    else:
+        keys = list(keys)
+        conn.execute(
+            f"DELETE FROM series_values WHERE series_id IN ({_placeholders(series_ids)}) "
+            f"AND datetime IN ({_placeholders(keys)})", series_ids + keys)
+        rows = conn.execute(f"SELECT datetime, {', '.join(indicators)} FROM {table} "
+                            f"WHERE datetime IN ({_placeholders(keys)})", keys)
+    values = [
+        (ids[indicator], row[0], row[i + 1])
+        for row in rows.fetchall()
+        for i, indicator in enumerate(indicators)
+        if row[i + 1] is not None
+    ]
+    conn.executemany("INSERT INTO series_values (series_id, datetime, value) VALUES (?, ?, ?)", values)
+    return len(values)
+
+
+def build(path=DB_PATH, country=DEFAULT_COUNTRY):
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            ensure_schema(conn)
+            counts = {frequency: sync_from_legacy(conn, frequency, country=country) for frequency in LEGACY_TABLES}
+        conn.execute("ANALYZE series_values")
+    finally:
+        conn.close()
+    return counts
+
+
+class SeriesStore:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+
+    def catalog(self, country=None, frequency=None):
+        df = db.read_sql("SELECT * FROM series ORDER BY series_id", path=self.path)
+        if country is not None:
+            df = df[df["country"] == country]
+        if frequency is not None:
+            df = df[df["frequency"] == frequency]
+        return df.reset_index(drop=True)
+
+    def countries(self):
+        return sorted(self.catalog()["country"].unique())
+
+    def _series_ids(self, indicators, country, frequency):
+        catalog = self.catalog(country, frequency).set_index("indicator")
+        if indicators is None:
+            indicators = list(catalog.index)
+        indicators = [indicator for indicator in indicators if indicator in catalog.index]
+        return indicators, {int(catalog.at[indicator, "series_id"]): indicator for indicator in indicators}
+
+    def load(self, indicators=None, country=DEFAULT_COUNTRY, frequency="Q", start=None, end=None):
+        # Wide frame (datetime + one column per indicator) for just the requested series and range
+        indicators, ids = self._series_ids(indicators, country, frequency)
+        if not ids:
+            return pd.DataFrame(columns=["datetime"] + indicators)
+        sql = (f"SELECT series_id, datetime, value FROM series_values "
+               f"WHERE series_id IN ({_placeholders(ids)})")
+        params = list(ids)
+        if start is not None:
+            sql += " AND datetime >= ?"
+            params.append(str(start))
+        if end is not None:
+            sql += " AND datetime <= ?"
+            params.append(str(end))
+        long = db.read_sql(sql, params, path=self.path)
+        return self._to_wide(long, ids, indicators)
+
+    def latest(self, indicators=None, country=DEFAULT_COUNTRY, frequency="Q", n=2):
+        # Last n observed points of each series, read backwards along the primary key
+        indicators, ids = self._series_ids(indicators, country, frequency)
+        frames = []
+        series_ids = list(ids)
+        for i in range(0, len(series_ids), MAX_COMPOUND_SELECTS):
+            chunk = series_ids[i:i + MAX_COMPOUND_SELECTS]
+            sql = " UNION ALL ".join(
+                "SELECT * FROM (SELECT series_id, datetime, value FROM series_values "
+                "WHERE series_id = ? ORDER BY datetime DESC LIMIT ?)" for _ in chunk)
+            params = [param for series_id in chunk for param in (series_id, n)]
+            frames.append(db.read_sql(sql, params, path=self.path))
+        if not frames:
+            return pd.DataFrame(columns=["indicator", "datetime", "value"])
+        long = pd.concat(frames, ignore_index=True)
+        long["indicator"] = long["series_id"].map(ids)
+        long["datetime"] = pd.to_datetime(long["datetime"])
+        return long[["indicator", "datetime", "value"]]
+
+    def iter_long(self, indicators=None, country=DEFAULT_COUNTRY, frequency="Q", chunksize=50000):
+        # Long-format rows of many series in chunks, for exports too large to build at once
+        sql = ("SELECT s.country, s.indicator, s.frequency, v.datetime, v.value "
+               "FROM series_values v JOIN series s ON s.series_id = v.series_id WHERE 1 = 1")
+        params = []
+        for column, value in (("country", country), ("frequency", frequency)):
+            if value is not None:
+                sql += f" AND s.{column} = ?"
+                params.append(value)
+        if indicators is not None:
+            sql += f" AND s.indicator IN ({_placeholders(indicators)})"
+            params.extend(indicators)
+        for chunk in db.iter_sql(sql + " ORDER BY v.series_id, v.datetime", params, chunksize, path=self.path):
+            chunk["datetime"] = pd.to_datetime(chunk["datetime"])
+            yield chunk
+
+    @staticmethod
+    def _to_wide(long, ids, indicators):
+        long["indicator"] = long["series_id"].map(ids)
+        wide = long.pivot(index="datetime", columns="indicator", values="value")
+        wide = wide.reindex(columns=indicators).sort_index().reset_index()
+        wide.columns.name = None
+        wide["datetime"] = pd.to_datetime(wide["datetime"])
+        return wide
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the long-format series store from the market_data_* tables")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--country", default=DEFAULT_COUNTRY)
+    args = parser.parse_args()
+
+    counts = build(args.db, args.country)
+    for frequency, count in counts.items():
+        print(f"Stored {count} {frequency} values for {args.country}")
+
+
+if __name__ == "__main__":
+    main()
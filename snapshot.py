@@ -0,0 +1,261 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+import anomalies
+import db
+import reconcile
+import sections
+from db import DB_PATH
+from forecasts import load_forecast
+from series_store import DEFAULT_COUNTRY, SeriesStore
+
+# Pre-rendered dashboard1 per data version. `python snapshot.py` (or `ingest.py --snapshot`)
+# writes the KPI card values, section tables (Parquet) and Plotly figure JSON for every
+# granularity/indicator and forecast horizon into snapshots/<version>/, plus an index.html
+# that works without Streamlit. While the database is unchanged the page reads artifacts
+# from that directory, loaded once per process, instead of querying and rebuilding them
+# for every session; anything missing (or a changed database) falls back to a live build.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.environ.get("DASHBOARD_SNAPSHOT_DIR", os.path.join(BASE_DIR, "snapshots"))
+MAX_SNAPSHOTS = 3
+DEFAULT_FORECAST_PERIODS = 6
+# Builds restarted when the database changes underneath them
+BUILD_ATTEMPTS = 3
+
+_lock = threading.Lock()
+_current = {}
+
+
+def _digest(stamp):
+    return hashlib.sha1(repr(stamp).encode()).hexdigest()[:16]
+
+
+def version_id(path=DB_PATH):
+    # Same notion of "data version" as the query and figure caches
+    return _digest(db.data_version(path))
+
+
+class Snapshot:
+    # Artifacts of one snapshot directory; with directory=None everything is built live
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.manifest = {"tables": [], "figures": []}
+        if directory is not None:
+            with open(os.path.join(directory, "manifest.json")) as f:
+                self.manifest = json.load(f)
+        self._loaded = {}
+
+    def _get(self, kind, name, load, build):
+        if name not in self.manifest[kind]:
+            return build()
+        key = (kind, name)
+        with _lock:
+            if key in self._loaded:
+                return self._loaded[key]
+        value = load(os.path.join(self.directory, kind, name))
+        with _lock:
+            self._loaded[key] = value
+        return value
+
+    def table(self, name, build):
+        # Shared between sessions: callers must not modify the frame
+        return self._get("tables", name, lambda stem: pd.read_parquet(stem + ".parquet"), build)
+
+    def tables(self, names, build):
+        # Several tables that are built together; `build` returns them as a tuple
+        if any(name not in self.manifest["tables"] for name in names):
+            return build()
+        return tuple(self.table(name, None) for name in names)
+
+    def figure(self, name, build):
+        return self._get("figures", name, lambda stem: pio.read_json(stem + ".json"), build)
+
+
+def current(path=DB_PATH, country=DEFAULT_COUNTRY, root=SNAPSHOT_DIR):
+    version = version_id(path)
+    with _lock:
+        snapshot = _current.get((path, country))
+        if snapshot is not None and snapshot.manifest.get("version") == version:
+            return snapshot
+    directory = os.path.join(root, version)
+    snapshot = Snapshot()
+    if os.path.exists(os.path.join(directory, "manifest.json")):
+        found = Snapshot(directory)
+        if found.manifest["country"] == country:
+            snapshot = found
+    with _lock:
+        _current[(path, country)] = snapshot
+    return snapshot
+
+
+def artifacts(path=DB_PATH, country=DEFAULT_COUNTRY):
+    store = SeriesStore(path)
+    tables = {
+        "qoq_cards": sections.qoq_cards(store, country),
+        "prediction": sections.latest_prediction(path),
+        "accuracy": reconcile.accuracy(path),
+        "alerts": anomalies.recent(limit=10, country=country, path=path),
+    }
+    figures = {}
+    for frequency in ("Q", "Y"):
+        for kpi in store.catalog(country, frequency)["indicator"]:
+            df = store.load([kpi], country, frequency)
+            tables[f"scatter_{frequency}_{kpi}"] = df
+            figures[f"scatter_{frequency}_{kpi}"] = sections.scatter_figure(df, kpi)
+    forecast = load_forecast("building_permits", country, "M", periods=max(sections.FORECAST_PERIODS), path=path)
+    if not forecast.empty:
+        history = sections.prophet_history(store, country)
+        tables["prophet_history"] = history
+        for periods in sections.FORECAST_PERIODS:
+            horizon = forecast[forecast["step"] <= periods].reset_index(drop=True)
+            tables[f"forecast_{periods}"] = horizon
+            figures[f"prophet_{periods}"] = sections.prophet_figure(history, horizon)
+    tables["yoy"], tables["yoy_melt"] = sections.yoy_tables(store, country)
+    figures["yoy"] = sections.yoy_figure(tables["yoy_melt"])
+    tables["moving_average"] = sections.moving_average_table(store, country)
+    figures["moving_average"] = sections.moving_average_figure(tables["moving_average"])
+    return tables, figures
+
+
+def _card(name, change, comparison):
+    if pd.isna(change):
+        value, color = "N/A", "#888"
+    else:
+        value, color = f"{'+' if change >= 0 else ''}{change}%", "green" if change >= 0 else "red"
+    return (f"<div class='card'><h4>{html.escape(name)}</h4><p style='color: {color}; font-size: 18px'>{value}</p>"
+            f"<p class='muted'>{html.escape(str(comparison))}</p></div>")
+
+
+def render_html(tables, figures, country, built_at):
+    # Static page with the default view of every section; plotly.min.js sits next to it
+    def chart(name):
+        if name not in figures:
+            return "<p class='muted'>Not available.</p>"
+        return figures[name].to_html(full_html=False, include_plotlyjs=False)
+
+    cards = "".join(_card(row.name, row.change_pct, row.comparison) for row in tables["qoq_cards"].itertuples())
+    prediction = tables["prediction"]
+    if prediction.empty:
+        forecast_metrics = "<p class='muted'>No predictions available yet.</p>"
+    else:
+        row = prediction.iloc[0]
+        quarter = pd.Timestamp(row["current_quarter"]).to_period("Q").strftime("Q%q %Y")
+        actual = f"{int(row['actual_permits']):,}" if pd.notna(row["actual_permits"]) else "Pending"
+        forecast_metrics = (f"<div class='card'><h4>📌 {quarter} – Building Permits</h4><p>{actual}</p></div>"
+                            f"<div class='card'><h4>📌 Next Quarter – Predicted Permits</h4>"
+                            f"<p>{int(row['predicted_permits']):,}</p></div>")
+    scatter = "".join(
+        f"<details><summary>{html.escape(sections.title(name.split('_', 2)[2]))} "
+        f"({'Quarterly' if name.split('_')[1] == 'Q' else 'Yearly'})</summary>{chart(name)}</details>"
+        for name in figures if name.startswith("scatter_"))
+    alerts = tables["alerts"]
+    alerts_html = (alerts[["name", "frequency", "datetime", "value", "change", "expected_change", "score"]]
+                   .to_html(index=False, border=0) if not alerts.empty else "<p class='muted'>No anomalies recorded.</p>")
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Construction Market Analytics</title>
+<script src="plotly.min.js"></script>
+<style>
+    body {{ background-color: #f5f5f5; font-family: sans-serif; margin: 0 auto; max-width: 1200px; }}
+    section {{ border: 1px solid #ddd; border-radius: 5px; padding: 10px; margin: 10px 0; background: white; }}
+    .cards {{ display: flex; gap: 10px; }}
+    .card {{ flex: 1; text-align: center; padding: 10px; border: 1px solid #ddd; border-radius: 5px; }}
+    .card h4, .card p {{ margin: 0 0 8px 0; }}
+    .muted {{ color: #888; font-size: 12px; }}
+</style>
+</head>
+<body>
+<div style="text-align: center;">
+    <h1 style="margin-bottom: 0;">Construction Market Analytics</h1>
+    <h3 style="margin-top: 0;">{html.escape(country)}</h3>
+    <p class="muted">Snapshot built {built_at} UTC. Data Source: <a href="https://tradingeconomics.com/">TradingEconomics.com</a></p>
+</div>
+<section><h3>Quarter-over-Quarter Changes</h3><div class="cards">{cards}</div></section>
+<section><h3>🚨 Anomaly Alerts</h3>{alerts_html}</section>
+<section><h3>Indicators Over Time</h3>{scatter}</section>
+<section><h3>📈 Building Permits Forecast Based on Residential Property Prices</h3><div class="cards">{forecast_metrics}</div></section>
+<section><h3>📅 Building Permits Forecast (Prophet), {DEFAULT_FORECAST_PERIODS} months</h3>{chart(f"prophet_{DEFAULT_FORECAST_PERIODS}")}</section>
+<section><h3>📊 Year-over-Year Growth</h3>{chart("yoy")}</section>
+<section><h3>🧮 Construction Output – 3-Month Moving Average</h3>{chart("moving_average")}</section>
+</body>
+</html>
+"""
+
+
+def _prune(root, keep):
+    # Oldest snapshots go first; the one just built is always kept
+    directories = [os.path.join(root, name) for name in os.listdir(root)
+                   if os.path.exists(os.path.join(root, name, "manifest.json"))]
+    directories.sort(key=os.path.getmtime, reverse=True)
+    for directory in directories[MAX_SNAPSHOTS:]:
+        if directory != keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def build(path=DB_PATH, country=DEFAULT_COUNTRY, root=SNAPSHOT_DIR, force=False):
+    # Directory of the snapshot for the current data version, rendered unless it exists
+    for _ in range(BUILD_ATTEMPTS):
+        stamp = db.data_version(path)
+        version = _digest(stamp)
+        directory = os.path.join(root, version)
+        if os.path.exists(os.path.join(directory, "manifest.json")) and not force:
+            return directory, False
+        built_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        tables, figures = artifacts(path, country)
+        # Only a version that held for the whole build names the directory
+        if db.data_version(path) == stamp:
+            break
+    else:
+        raise RuntimeError(f"{path} kept changing while the snapshot was built")
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, "tables"))
+    os.makedirs(os.path.join(tmp_dir, "figures"))
+    for name, df in tables.items():
+        df.to_parquet(os.path.join(tmp_dir, "tables", name + ".parquet"), index=False)
+    for name, fig in figures.items():
+        with open(os.path.join(tmp_dir, "figures", name + ".json"), "w") as f:
+            f.write(pio.to_json(fig))
+    with open(os.path.join(tmp_dir, "plotly.min.js"), "w") as f:
+        f.write(get_plotlyjs())
+    with open(os.path.join(tmp_dir, "index.html"), "w") as f:
+        f.write(render_html(tables, figures, country, built_at))
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump({"version": version, "data_version": list(stamp), "country": country,
+                   "built_at": built_at, "tables": sorted(tables), "figures": sorted(figures)}, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    with open(os.path.join(root, "LATEST.tmp"), "w") as f:
+        f.write(version + "\n")
+    os.replace(os.path.join(root, "LATEST.tmp"), os.path.join(root, "LATEST"))
+    _prune(root, directory)
+    return directory, True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render dashboard1 for the current data version")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--country", default=DEFAULT_COUNTRY)
+    parser.add_argument("--output", default=SNAPSHOT_DIR, help="directory holding one subdirectory per version")
+    parser.add_argument("--force", action="store_true", help="rebuild even if this version has a snapshot")
+    args = parser.parse_args()
+
+    directory, built = build(args.db, args.country, args.output, args.force)
+    print(f"{'Built' if built else 'Up to date'}: {directory}")
+    print(f"Static page: python -m http.server --directory {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
+import time
+
+# Taken before the imports, so the first rerun's KPI timing includes them
+STARTED = time.perf_counter()
+
 import streamlit as st
-import requests
-import sqlite3
 import pandas as pd
 import plotly.express as px
+import db
+from forecasts import forecast_figure, load_forecast
+from kpi import latest_vs_previous, period_labels
+from series_store import DEFAULT_COUNTRY, SeriesStore
+from charts import cached_figure, downsample
+from chat_client import render_sidebar_chat
+from instrumentation import Recorder
 
 # Must be the first Streamlit command
 st.set_page_config(layout="wide")
@@ -17,44 +27,15 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Per-section timings for this rerun; add ?debug=1 to the URL to see them
+recorder = Recorder("streamlit_app", STARTED)
+
 # Your n8n production webhook URL
 N8N_WEBHOOK_URL = "https://f089-62-250-42-200.ngrok-free.app/webhook/f189b9b1-314e-4bbc-a8e4-105912501679"
 
-# Initialize session state to store chat history
-if "messages" not in st.session_state:
-    st.session_state.messages = [{"role": "assistant", "content": "Hi! How can I assist you today?"}]
-
-# Sidebar for the chat
-with st.sidebar:
-    st.header("Chat with Assistant")
-
-    chat_container = st.container(height=400)
-    with chat_container:
-        for message in st.session_state.messages:
-            with st.chat_message(message["role"]):
-                st.write(message["content"])
-
-    if prompt := st.chat_input("Type your message here", key="sidebar_chat_input"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with chat_container:
-            with st.chat_message("user"):
-                st.write(prompt)
-
-            with st.chat_message("assistant"):
-                with st.spinner("Processing your request... This may take up to 30 seconds."):
-                    try:
-                        payload = {"message": prompt}
-                        headers = {"Content-Type": "application/json"}
-                        response = requests.post(N8N_WEBHOOK_URL, json=payload, headers=headers, timeout=300)
-                        response.raise_for_status()
-                        assistant_response = response.text
-                    except requests.exceptions.RequestException as e:
-                        assistant_response = f"Error connecting to n8n: {str(e)}"
-                        st.write(f"Error: {assistant_response}")
-
-                st.write(assistant_response)
-                st.session_state.messages.append({"role": "assistant", "content": assistant_response})
-
+# Sidebar chat; the webhook call runs in the background so the page keeps rendering
+with recorder.section("chat"):
+    render_sidebar_chat(N8N_WEBHOOK_URL)
 
 # ----------------- MAIN CONTENT -----------------
 st.markdown("""
@@ -65,178 +46,213 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Connect to database
-conn = sqlite3.connect("market_data.db")
-
-# Load latest two months of data for percent change cards
-df_monthly = pd.read_sql("SELECT * FROM market_data_monthly ORDER BY datetime DESC LIMIT 2", conn)
+with recorder.section("mom_cards"):
+    # Latest two observed months of each series for percent change cards
+    df_monthly = SeriesStore().latest(["building_permits", "construction_output"], DEFAULT_COUNTRY, "M", n=2)
+
+    # Calculate percent changes
+    changes = latest_vs_previous(df_monthly, "M").set_index("indicator")["change_pct"]
+    changes = changes.astype(object).where(changes.notna(), None)
+    change_building = changes.get("building_permits")
+    change_output = changes.get("construction_output")
+
+    # KPI cards
+    st.markdown("""
+    <div style='display: flex; justify-content: space-around; margin-bottom: 20px;'>
+        <div style='border: 1px solid #ccc; border-radius: 8px; padding: 10px; width: 22%; text-align: center;'>
+            <h5 style='margin-bottom: 6px;'>Building Permits – % Change from Last Month</h5>
+            <p style='color: {color1}; font-size: 20px;'><strong>{change_building:+.2f}%</strong></p>
+        </div>
+        <div style='border: 1px solid #ccc; border-radius: 8px; padding: 10px; width: 22%; text-align: center;'>
+            <h5 style='margin-bottom: 6px;'>Construction Output – % Change from Last Month</h5>
+            <p style='color: {color2}; font-size: 20px;'><strong>{change_output:+.2f}%</strong></p>
+        </div>
+    </div>
+    """.format(
+        change_building=change_building if change_building is not None else 0.0,
+        change_output=change_output if change_output is not None else 0.0,
+        color1="green" if change_building and change_building >= 0 else "red",
+        color2="green" if change_output and change_output >= 0 else "red"
+    ), unsafe_allow_html=True)
+recorder.first_kpi()
 
-# Calculate percent changes
-def calc_change(col):
-    if len(df_monthly) < 2 or pd.isna(df_monthly[col].iloc[1]) or pd.isna(df_monthly[col].iloc[0]):
-        return None
-    return round(((df_monthly[col].iloc[0] - df_monthly[col].iloc[1]) / df_monthly[col].iloc[1]) * 100, 2)
 
-change_building = calc_change("building_permits")
-change_output = calc_change("construction_output")
+# Section boxes in page order. The forecast metrics and SQL viewer are filled first;
+# the chart and table sections fill their boxes afterwards, as fragments that rerun on
+# their own instead of rerunning the whole page
+scatter_box = st.container(border=True)
+forecast_box, prophet_box, sql_box, quarterly_box, yoy_box, ma_box = (st.container() for _ in range(6))
 
-# KPI cards
-st.markdown("""
-<div style='display: flex; justify-content: space-around; margin-bottom: 20px;'>
-    <div style='border: 1px solid #ccc; border-radius: 8px; padding: 10px; width: 22%; text-align: center;'>
-        <h5 style='margin-bottom: 6px;'>Building Permits – % Change from Last Month</h5>
-        <p style='color: {color1}; font-size: 20px;'><strong>{change_building:+.2f}%</strong></p>
-    </div>
-    <div style='border: 1px solid #ccc; border-radius: 8px; padding: 10px; width: 22%; text-align: center;'>
-        <h5 style='margin-bottom: 6px;'>Construction Output – % Change from Last Month</h5>
-        <p style='color: {color2}; font-size: 20px;'><strong>{change_output:+.2f}%</strong></p>
-    </div>
-</div>
-""".format(
-    change_building=change_building if change_building is not None else 0.0,
-    change_output=change_output if change_output is not None else 0.0,
-    color1="green" if change_building and change_building >= 0 else "red",
-    color2="green" if change_output and change_output >= 0 else "red"
-), unsafe_allow_html=True)
 
 # Visualization section
-with st.container(border=True):
-    col_select1, col_select2 = st.columns([1, 2])
+@st.fragment
+def scatter_section():
+    with recorder.fragment("scatter"):
+        col_select1, col_select2 = st.columns([1, 2])
+
+        with col_select1:
+            granularity = st.radio("Select data granularity:", ["Quarterly", "Yearly"], horizontal=True)
+
+        # Load appropriate table
+        table = "market_data_quarterly" if granularity == "Quarterly" else "market_data_yearly"
+        df = db.read_sql(f"SELECT * FROM {table} ORDER BY datetime")
+        df['datetime'] = pd.to_datetime(df['datetime'])
+
+        with col_select2:
+            kpi_options = [col for col in df.columns if col not in ["datetime", "year", "quarter"]]
+            kpi = st.selectbox("Select KPI to plot:", kpi_options)
+
+        st.subheader(f"{kpi.replace('_', ' ').title()} Over Time ({granularity})")
+
+        def build():
+            fig = px.scatter(downsample(df, "datetime", [kpi]), x="datetime", y=kpi, title=f"{kpi.replace('_', ' ').title()} Over Time", 
+                             labels={"datetime": "Date", kpi: kpi.replace('_', ' ').title()}, color_discrete_sequence=["#008080"])
+            fig.update_traces(mode='lines+markers')
+            return fig
+        st.plotly_chart(cached_figure(("legacy_scatter", table, kpi), build), use_container_width=True)
+
+
+# Prophet Forecast section, precomputed by forecasts.py
+@st.fragment
+def prophet_section():
+    with recorder.fragment("prophet"):
+        forecast = load_forecast("building_permits", DEFAULT_COUNTRY, "M", periods=3)
+        if not forecast.empty:
+            history = SeriesStore().load(["building_permits"], DEFAULT_COUNTRY, "M").rename(columns={"datetime": "ds", "building_permits": "y"})
+            fig_prophet = cached_figure(("prophet", DEFAULT_COUNTRY, "building_permits", 3), lambda: forecast_figure(
+                downsample(history, "ds", ["y"]), downsample(forecast, "ds", ["yhat", "yhat_lower", "yhat_upper"])))
+            st.plotly_chart(fig_prophet, use_container_width=True)
+        else:
+            st.warning("No forecasts available yet. Run forecasts.py to compute them.")
 
-    with col_select1:
-        granularity = st.radio("Select data granularity:", ["Quarterly", "Yearly"], horizontal=True)
 
-    # Load appropriate table
-    table = "market_data_quarterly" if granularity == "Quarterly" else "market_data_yearly"
-    df = pd.read_sql(f"SELECT * FROM {table}", conn)
-    df['datetime'] = pd.to_datetime(df['datetime'])
+# Table View of Market Data Quarterly
+@st.fragment
+def quarterly_table_section():
+    with recorder.fragment("quarterly_table"):
+        st.markdown("---")
+        st.header("📋 Quarterly Market Data Table")
+        df_quarterly = db.read_sql("SELECT * FROM market_data_quarterly ORDER BY datetime DESC")
+        df_quarterly['datetime'] = pd.to_datetime(df_quarterly['datetime'])
+        df_quarterly['quarter_label'] = period_labels(df_quarterly['datetime'], "Q", "%Y Q%q")
+        df_quarterly_display = df_quarterly[['quarter_label', 'building_permits', 'construction_output', 'price_to_rent_ratio', 'residential_prices']]
+        st.dataframe(df_quarterly_display, use_container_width=True)
 
-    with col_select2:
-        kpi_options = [col for col in df.columns if col not in ["datetime", "year", "quarter"]]
-        kpi = st.selectbox("Select KPI to plot:", kpi_options)
 
-    st.subheader(f"{kpi.replace('_', ' ').title()} Over Time ({granularity})")
-    fig = px.scatter(df, x="datetime", y=kpi, title=f"{kpi.replace('_', ' ').title()} Over Time", 
-                     labels={"datetime": "Date", kpi: kpi.replace('_', ' ').title()}, color_discrete_sequence=["#008080"])
-    fig.update_traces(mode='lines+markers')
-    st.plotly_chart(fig, use_container_width=True)
+# Load YoY data
+@st.fragment
+def yoy_section():
+    with recorder.fragment("yoy"):
+        df_yoy = db.read_sql("SELECT * FROM market_data_yoy ORDER BY year")
+
+        # Melt for visualization
+        df_yoy_melt = df_yoy.melt(id_vars="year", 
+                                  value_vars=["permits_yoy_pct", "prices_yoy_pct", "ratio_yoy_pct", "output_yoy_pct"],
+                                  var_name="Metric", value_name="YoY Growth (%)")
+
+        # Clean names
+        df_yoy_melt["Metric"] = df_yoy_melt["Metric"].replace({
+            "permits_yoy_pct": "Building Permits",
+            "prices_yoy_pct": "Residential Prices",
+            "ratio_yoy_pct": "Price-to-Rent Ratio",
+            "output_yoy_pct": "Construction Output"
+        })
+
+        # Bar chart
+        st.markdown("### 📊 Year-over-Year Growth")
+        def build_yoy():
+            fig_yoy = px.bar(df_yoy_melt, x="year", y="YoY Growth (%)", color="Metric", 
+                             barmode="group", text="YoY Growth (%)",
+                             color_discrete_sequence=px.colors.qualitative.Set2)
+
+            fig_yoy.update_traces(textposition="outside")
+            fig_yoy.update_layout(yaxis_tickformat=".2f", xaxis_title="Year", yaxis_title="% Change")
+            return fig_yoy
+        st.plotly_chart(cached_figure(("legacy_yoy",), build_yoy), use_container_width=True)
+
+        # Optional: Display table
+        with st.expander("🔍 View Raw Data Table"):
+            st.dataframe(df_yoy, use_container_width=True)
 
-# --- Building Permits Forecast Section ---
-st.markdown("### 📈 Building Permits Forecast")
-
-# Load prediction from database
-conn = sqlite3.connect("market_data.db")
-df_pred = pd.read_sql("SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1", conn)
-
-if not df_pred.empty:
-    actual = int(df_pred["actual_permits"].values[0])
-    predicted = int(df_pred["predicted_permits"].values[0])
-    quarter_str = pd.to_datetime(df_pred["current_quarter"].values[0]).to_period("Q").strftime("Q%q %Y")
-
-    colf1, colf2 = st.columns(2)
-    with colf1:
-        st.metric(label=f"📌 {quarter_str} – Building Permits", value=f"{actual:,}")
-    with colf2:
-        st.metric(label=f"📌 Next Quarter – Predicted Permits", value=f"{predicted:,}")
-else:
-    st.warning("No predictions available yet.")
-
-# Prophet Forecast section
-if Prophet:
-    df_prophet = pd.read_sql("SELECT datetime, building_permits FROM market_data_monthly WHERE building_permits IS NOT NULL ORDER BY datetime", conn)
-    df_prophet = df_prophet.rename(columns={"datetime": "ds", "building_permits": "y"})
-
-    m = Prophet()
-    m.fit(df_prophet)
-    future = m.make_future_dataframe(periods=3, freq="M")
-    forecast = m.predict(future)
-
-    fig_prophet = plot_plotly(m, forecast)
-    st.plotly_chart(fig_prophet, use_container_width=True)
-else:
-    st.warning("Prophet library not installed. Forecasting feature unavailable.")
 
-# SQL Query Viewer Section
-st.markdown("---")
-st.header("🧠 SQL Growth Queries")
-with st.expander("📄 Show Year-over-Year Growth SQL Query"):
-    query_yoy = """
-    WITH yearly AS (
-        SELECT
-            CAST(STRFTIME('%Y', datetime) AS INTEGER) AS year,
-            building_permits,
-            residential_prices,
-            price_to_rent_ratio,
-            construction_output
-        FROM market_data_yearly
-    ),
-    yoy AS (
-        SELECT
-            curr.year,
-            ROUND(curr.building_permits, 2) AS current_permits,
-            ROUND(prev.building_permits, 2) AS previous_permits,
-            ROUND((curr.building_permits - prev.building_permits) * 100.0 / prev.building_permits, 2) AS permits_yoy_pct
-        FROM yearly curr
-        JOIN yearly prev ON curr.year = prev.year + 1
-    )
-    SELECT * FROM yoy
-    ORDER BY year;
-    """
-    st.code(query_yoy, language="sql")
+# Load moving average data
+@st.fragment
+def moving_average_section():
+    with recorder.fragment("moving_average"):
+        df_ma = db.read_sql("SELECT * FROM market_data_m_avg ORDER BY date")
 
-# Table View of Market Data Quarterly
-st.markdown("---")
-st.header("📋 Quarterly Market Data Table")
-df_quarterly = pd.read_sql("SELECT * FROM market_data_quarterly ORDER BY datetime DESC", conn)
-df_quarterly['datetime'] = pd.to_datetime(df_quarterly['datetime'])
-df_quarterly['quarter_label'] = df_quarterly['datetime'].apply(lambda d: f"{d.year} Q{(d.month-1)//3 + 1}")
-df_quarterly_display = df_quarterly[['quarter_label', 'building_permits', 'construction_output', 'price_to_rent_ratio', 'residential_prices']]
-st.dataframe(df_quarterly_display, use_container_width=True)
+        st.markdown("### 🧮 Construction Output – 3-Month Moving Average")
+        def build_ma():
+            fig_ma = px.line(downsample(df_ma, "date", ["current_output", "output_3mo_avg"]), x="date", y=["current_output", "output_3mo_avg"],
+                             labels={"value": "Construction Output", "date": "Date"},
+                             title="Construction Output vs 3-Month Moving Average",
+                             color_discrete_map={"current_output": "#1f77b4", "output_3mo_avg": "#ff7f0e"})
 
-conn.close()
+            fig_ma.update_layout(legend_title_text="Legend")
+            return fig_ma
+        st.plotly_chart(cached_figure(("legacy_moving_average",), build_ma), use_container_width=True)
 
-# Load YoY data
-with sqlite3.connect("market_data.db") as conn:
-    df_yoy = pd.read_sql("SELECT * FROM market_data_yoy", conn)
-
-# Melt for visualization
-df_yoy_melt = df_yoy.melt(id_vars="year", 
-                          value_vars=["permits_yoy_pct", "prices_yoy_pct", "ratio_yoy_pct", "output_yoy_pct"],
-                          var_name="Metric", value_name="YoY Growth (%)")
-
-# Clean names
-df_yoy_melt["Metric"] = df_yoy_melt["Metric"].replace({
-    "permits_yoy_pct": "Building Permits",
-    "prices_yoy_pct": "Residential Prices",
-    "ratio_yoy_pct": "Price-to-Rent Ratio",
-    "output_yoy_pct": "Construction Output"
-})
-
-# Bar chart
-st.markdown("### 📊 Year-over-Year Growth")
-fig_yoy = px.bar(df_yoy_melt, x="year", y="YoY Growth (%)", color="Metric", 
-                 barmode="group", text="YoY Growth (%)",
-                 color_discrete_sequence=px.colors.qualitative.Set2)
-
-fig_yoy.update_traces(textposition="outside")
-fig_yoy.update_layout(yaxis_tickformat=".2f", xaxis_title="Year", yaxis_title="% Change")
-st.plotly_chart(fig_yoy, use_container_width=True)
-
-# Optional: Display table
-with st.expander("🔍 View Raw Data Table"):
-    st.dataframe(df_yoy, use_container_width=True)
 
-# Load moving average data
-with sqlite3.connect("market_data.db") as conn:
-    df_ma = pd.read_sql("SELECT * FROM market_data_m_avg", conn)
+# --- Building Permits Forecast Section ---
+with recorder.section("forecast_metrics"), forecast_box:
+    st.markdown("### 📈 Building Permits Forecast")
 
-st.markdown("### 🧮 Construction Output – 3-Month Moving Average")
-fig_ma = px.line(df_ma, x="date", y=["current_output", "output_3mo_avg"],
-                 labels={"value": "Construction Output", "date": "Date"},
-                 title="Construction Output vs 3-Month Moving Average",
-                 color_discrete_map={"current_output": "#1f77b4", "output_3mo_avg": "#ff7f0e"})
+    # Load prediction from database
+    df_pred = db.read_sql("SELECT * FROM building_permit_predictions ORDER BY current_quarter DESC LIMIT 1")
 
-fig_ma.update_layout(legend_title_text="Legend")
-st.plotly_chart(fig_ma, use_container_width=True)
+    if not df_pred.empty:
+        actual = df_pred["actual_permits"].values[0]
+        predicted = int(df_pred["predicted_permits"].values[0])
+        quarter_str = pd.to_datetime(df_pred["current_quarter"].values[0]).to_period("Q").strftime("Q%q %Y")
 
+        colf1, colf2 = st.columns(2)
+        with colf1:
+            st.metric(label=f"📌 {quarter_str} – Building Permits", value=f"{int(actual):,}" if pd.notna(actual) else "Pending")
+        with colf2:
+            st.metric(label=f"📌 Next Quarter – Predicted Permits", value=f"{predicted:,}")
+    else:
+        st.warning("No predictions available yet.")
 
+# SQL Query Viewer Section
+with sql_box:
+    st.markdown("---")
+    st.header("🧠 SQL Growth Queries")
+    with st.expander("📄 Show Year-over-Year Growth SQL Query"):
+        query_yoy = """
+        WITH yearly AS (
+            SELECT
+                CAST(STRFTIME('%Y', datetime) AS INTEGER) AS year,
+                building_permits,
+                residential_prices,
+                price_to_rent_ratio,
+                construction_output
+            FROM market_data_yearly
+        ),
+        yoy AS (
+            SELECT
+                curr.year,
+                ROUND(curr.building_permits, 2) AS current_permits,
+                ROUND(prev.building_permits, 2) AS previous_permits,
+                ROUND((curr.building_permits - prev.building_permits) * 100.0 / prev.building_permits, 2) AS permits_yoy_pct
+            FROM yearly curr
+            JOIN yearly prev ON curr.year = prev.year + 1
+        )
+        SELECT * FROM yoy
+        ORDER BY year;
+        """
+        st.code(query_yoy, language="sql")
+
+
+# Chart and table sections, once the cards are on screen
+with scatter_box:
+    scatter_section()
+with prophet_box:
+    prophet_section()
+with quarterly_box:
+    quarterly_table_section()
+with yoy_box:
+    yoy_section()
+with ma_box:
+    moving_average_section()
+
+recorder.finish()
@@ -0,0 +1,174 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import anomalies
+import forecasts
+import ingest
+import series_store
+from db import DB_PATH
+from ingest import DATE_FORMAT, SERIES
+from series_store import DEFAULT_COUNTRY
+
+# Synthetic market_data.db at any scale, for benchmarking the dashboards.
+# The schema is copied from the shipped database, the four German series are
+# generated as a TradingEconomics payload and loaded through ingest.py (so every
+# derived market_data_* table is filled exactly as in production), and any number
+# of extra countries and indicators are written straight into the series store.
+PANDAS_FREQUENCIES = {"M": "ME", "Q": "QE", "Y": "YE"}
+PERIODS_PER_YEAR = {"M": 12, "Q": 4, "Y": 1}
+# Start level and monthly drift/volatility (in percent) of each generated German series
+PROFILES = {
+    "GERMANYBUIPER": (15000, 0.1, 8.0),
+    "GermanyConOut": (-2.0, 0.0, 60.0),
+    "BDPRR": (120.0, 0.2, 1.0),
+    "BDRPP": (2.0, 0.0, 80.0),
+}
+
+
+def copy_schema(src, conn):
+    # Tables and indexes exactly as the migrated database has them, without data
+    schema = sqlite3.connect(src)
+    try:
+        statements = schema.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index', rowid").fetchall()
+        version = schema.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        schema.close()
+    for (sql,) in statements:
+        conn.execute(sql)
+    conn.execute(f"PRAGMA user_version = {version}")
+
+
+def _walk(rng, periods, start, drift_pct, volatility_pct):
+    # Random walk whose step size scales with the level, so values stay plausible
+    steps = rng.normal(drift_pct, volatility_pct, periods) / 100
+    return start + np.cumsum(steps * abs(start))
+
+
+def _dates(frequency, periods, end):
+    return pd.date_range(end=end, periods=periods, freq=PANDAS_FREQUENCIES[frequency])
+
+
+def german_payload(rng, months, end):
+    payload = {}
+    for symbol, spec in SERIES.items():
+        frequency = "M" if spec["monthly"] else "Q"
+        periods = months if spec["monthly"] else max(months // 3, 1)
+        start, drift, volatility = PROFILES[symbol]
+        if not spec["monthly"]:
+            drift, volatility = drift * 3, volatility * 3 ** 0.5
+        values = _walk(rng, periods, start, drift, volatility)
+        payload[symbol] = {
+            "metadata": {
+                "Country": DEFAULT_COUNTRY,
+                "Category": spec["column"].replace("_", " ").title(),
+                "Frequency": "Monthly" if spec["monthly"] else "Quarterly",
+                "HistoricalDataSymbol": symbol,
+            },
+            "data": [{"DateTime": d.strftime("%Y-%m-%d"), "Value": round(float(v), 4)}
+                     for d, v in zip(_dates(frequency, periods, end), values)],
+        }
+    return payload
+
+
+def add_predictions(conn):
+    # One past prediction per quarter so the prediction lookup and reconciliation have history
+    rows = conn.execute("""
+        SELECT datetime, residential_prices, building_permits,
+               LEAD(building_permits) OVER (ORDER BY datetime)
+        FROM market_data_quarterly
+        WHERE residential_prices IS NOT NULL AND building_permits IS NOT NULL
+    """).fetchall()
+    conn.executemany(
+        "INSERT OR REPLACE INTO building_permit_predictions "
+        "(current_quarter, residential_price, predicted_permits, actual_permits) VALUES (?, ?, ?, ?)",
+        [(quarter, price, int(permits * 1.02), None if actual is None else int(actual))
+         for quarter, price, permits, actual in rows])
+    return len(rows)
+
+
+def add_series(conn, rng, countries, indicators, frequencies, months, end):
+    total = 0
+    names = [f"indicator_{i + 1:03d}" for i in range(indicators)]
+    for c in range(countries + 1):
+        # Country 0 is Germany, which gets the extra indicators next to its real ones
+        country = DEFAULT_COUNTRY if c == 0 else f"Country {c:03d}"
+        for frequency in frequencies:
+            periods = max(months * PERIODS_PER_YEAR[frequency] // 12, 1)
+            keys = _dates(frequency, periods, end).strftime(DATE_FORMAT)
+            ids = series_store.ensure_series(conn, country, frequency, names)
+            for series_id in ids.values():
+                values = _walk(rng, periods, rng.uniform(50, 500), 0.1, 2.0)
+                conn.executemany("INSERT OR REPLACE INTO series_values (series_id, datetime, value) VALUES (?, ?, ?)",
+                                 zip([series_id] * periods, keys, np.round(values, 4).tolist()))
+                total += periods
+    return total
+
+
+def generate(path, months=72, countries=0, indicators=0, frequencies=("M", "Q", "Y"), end="2024-12-31",
+             seed=0, template=DB_PATH):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            copy_schema(template, conn)
+            series_store.ensure_schema(conn)
+            forecasts.ensure_schema(conn)
+    finally:
+        conn.close()
+
+    ingest.ingest(german_payload(rng, months, pd.Timestamp(end)), path)
+
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            predictions = add_predictions(conn)
+            values = add_series(conn, rng, countries, indicators, frequencies, months, pd.Timestamp(end))
+            # The extra series bypass ingest.py, so they are scored here
+            found = anomalies.update(conn)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("ANALYZE")
+        stats = {
+            "series": conn.execute("SELECT COUNT(*) FROM series").fetchone()[0],
+            "series_values": conn.execute("SELECT COUNT(*) FROM series_values").fetchone()[0],
+            "monthly_rows": conn.execute("SELECT COUNT(*) FROM market_data_monthly").fetchone()[0],
+            "predictions": predictions,
+            "synthetic_values": values,
+            "anomalies": found,
+        }
+    finally:
+        conn.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a schema-compatible synthetic market_data.db")
+    parser.add_argument("output", help="path of the database to (re)create")
+    parser.add_argument("--months", type=int, default=72, help="history length in months")
+    parser.add_argument("--countries", type=int, default=0, help="extra synthetic countries besides Germany")
+    parser.add_argument("--indicators", type=int, default=0, help="extra synthetic indicators per country")
+    parser.add_argument("--frequencies", default="M,Q,Y", help="frequencies of the extra indicators")
+    parser.add_argument("--end", default="2024-12-31", help="last date of the generated history")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.abspath(args.output) == os.path.abspath(DB_PATH):
+        parser.error("refusing to overwrite the shipped market_data.db")
+    frequencies = [f.strip().upper() for f in args.frequencies.split(",") if f.strip()]
+    if any(f not in PERIODS_PER_YEAR for f in frequencies):
+        parser.error(f"frequencies must be among {', '.join(PERIODS_PER_YEAR)}")
+    stats = generate(args.output, args.months, args.countries, args.indicators, frequencies, args.end, args.seed)
+    for name, count in stats.items():
+        print(f"{name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import shutil
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import ingest
+from db import DB_PATH
+
+# A full refresh of recent data through ingest() must rebuild the derived tables exactly
+# as they are in the shipped database.
+CUTOFF = "2023-07-01"
+# Rows deleted from each derived table before the refresh. The notebook's hand-entered
+# 2024-10-30 quarter has no raw points behind it, so it stays (and feeds 2024Q4 and 2024).
+DERIVED = {
+    "market_data_monthly": ("datetime", CUTOFF, "9999"),
+    "market_data_quarterly": ("datetime", CUTOFF, "2024-10-01"),
+    "market_data_yearly": ("datetime", CUTOFF, "9999"),
+    "market_data_qoq": ("quarter", "2023Q3", "9999"),
+    "market_data_yoy": ("year", 2023, 9999),
+    "market_data_m_avg": ("date", CUTOFF, "9999"),
+}
+
+
+def _table(conn, table):
+    df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    return df.sort_values(list(df.columns[:1])).reset_index(drop=True)
+
+
+@pytest.fixture
+def db_copy(tmp_path):
+    path = str(tmp_path / "market_data.db")
+    shutil.copy(DB_PATH, path)
+    return path
+
+
+def test_reingesting_recent_points_rebuilds_derived_tables(db_copy):
+    conn = sqlite3.connect(db_copy)
+    expected = {table: _table(conn, table) for table in DERIVED}
+    payload = {}
+    with conn:
+        for symbol, spec in ingest.SERIES.items():
+            rows = conn.execute(f"SELECT datetime, country, category, value, frequency, lastupdate FROM {spec['table']} "
+                                "WHERE datetime >= ? ORDER BY datetime", (CUTOFF,)).fetchall()
+            assert rows, f"no {spec['table']} points after {CUTOFF}"
+            payload[symbol] = {
+                "metadata": {"Country": rows[0][1], "Category": rows[0][2], "Frequency": rows[0][4],
+                             "HistoricalDataSymbol": symbol, "LastUpdate": rows[-1][5]},
+                "data": [{"DateTime": row[0][:10], "Value": row[3]} for row in rows],
+            }
+            conn.execute(f"DELETE FROM {spec['table']} WHERE datetime >= ?", (CUTOFF,))
+        for table, (column, start, end) in DERIVED.items():
+            conn.execute(f"DELETE FROM {table} WHERE {column} >= ? AND {column} < ?", (start, end))
+    conn.close()
+
+    summary = ingest.ingest(payload, db_copy)
+
+    assert summary == {ingest.SERIES[symbol]["table"]: len(series["data"]) for symbol, series in payload.items()}
+    conn = sqlite3.connect(db_copy)
+    try:
+        for table, df in expected.items():
+            pd.testing.assert_frame_equal(_table(conn, table), df, check_dtype=False, obj=table)
+    finally:
+        conn.close()
+
+
+def test_unknown_symbols_are_skipped(db_copy, caplog):
+    summary = ingest.ingest({"UNKNOWN": {"metadata": {}, "data": [{"DateTime": "2024-01-31", "Value": 1.0}]}}, db_copy)
+
+    assert summary == {}
+    assert "Skipping unknown symbol 'UNKNOWN'" in caplog.text